@@ -0,0 +1,138 @@
+"""Additive oscillator bank resynthesized with an inverse FFT.
+
+Every frame the partials are written straight into a spectrum: a windowed
+sinusoid only has energy in the few bins around its frequency, given by
+the transform of the Hann window. One inverse FFT then turns all partials
+into a windowed frame and frames overlap-added at half the FFT size sum
+back to the plain sum of sinusoids. Per frame this costs an FFT plus a few
+bins per partial, so hundreds or thousands of partials stay cheap, where a
+WaveAdder of SineOscillators costs a Python call per partial per sample.
+
+Amplitudes and frequencies of the partials are taken per frame, with the
+overlap-add crossfading between frames.
+"""
+import math
+
+import numpy as np
+
+from oscillators import Oscillator
+
+
+def hann_spectrum(theta, fft_size):
+    """Transform of the periodic Hann window of ``fft_size`` samples at the
+    angular frequencies ``theta``."""
+
+    def dirichlet(t):
+        half = np.sin(t / 2)
+        small = np.abs(half) < 1e-12
+        ratio = np.sin(fft_size * t / 2) / np.where(small, 1, half)
+        return np.exp(-0.5j * t * (fft_size - 1)) * np.where(
+            small, fft_size, ratio)
+
+    step = 2 * math.pi / fft_size
+    return (0.5 * dirichlet(theta) - 0.25 * dirichlet(theta - step) -
+            0.25 * dirichlet(theta + step))
+
+
+class AdditiveOscillator(Oscillator):
+    """Partials at ``ratios`` times the played frequency with ``amps``.
+
+    By default these are the first ``n_partials`` harmonics of a sawtooth.
+    Partials start as sines and those at or above the Nyquist frequency are
+    muted. ``kernel_bins`` is the number of bins written on each side of a
+    partial; with 8 the error of the truncated Hann kernel stays around
+    -55 dB of the partial's amplitude.
+    """
+
+    def __init__(self,
+                 freq=440,
+                 ratios=None,
+                 amps=None,
+                 n_partials=64,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1),
+                 fft_size=1024,
+                 kernel_bins=8):
+        assert fft_size % 2 == 0, f'Invalid fft_size: {fft_size}'
+        super().__init__(freq, 0, amp, sample_rate, wave_range)
+        self.fft_size = fft_size
+        self.hop = fft_size // 2
+        self.kernel_bins = kernel_bins
+        self._offsets = np.arange(-kernel_bins, kernel_bins + 1)
+        if ratios is None:
+            ratios = np.arange(1, n_partials + 1)
+        if amps is None:
+            amps = 2 / (math.pi * np.asarray(ratios, dtype=float))
+        self.set_partials(ratios, amps)
+
+    def set_partials(self, ratios=None, amps=None):
+        """Change the partials from the next frame on."""
+        if ratios is not None:
+            self.ratios = np.asarray(ratios, dtype=float)
+        if amps is not None:
+            self.amps = np.asarray(amps, dtype=float)
+        assert self.ratios.shape == self.amps.shape, \
+            'ratios and amps must have one value per partial'
+        if hasattr(self, '_phases') and len(self._phases) != len(self.ratios):
+            self._phases = np.full(len(self.ratios), -math.pi / 2)
+
+    def _initialize_osc(self):
+        self._phases = np.full(len(self.ratios), -math.pi / 2)
+        # samples ready to be output, and the overlap of the last frame
+        self._ready = np.empty(0)
+        self._tail = None
+
+    def __next__(self):
+        return self.render(1)[0]
+
+    def _frame(self, freq):
+        """Next windowed frame; the partials' phases refer to its centre."""
+        size = self.fft_size
+        omega = 2 * math.pi * freq * self.ratios / self._sample_rate
+        audible = (omega < math.pi) & (self.amps != 0)
+        w = omega[audible]
+        bins = np.rint(w * size / (2 * math.pi)).astype(int)
+        bins = bins[:, None] + self._offsets
+        theta = 2 * math.pi * bins / size - w[:, None]
+        # a / 2 * exp(i phase) at the centre sample, times the window kernel
+        vals = self.amps[audible] / 2 * np.exp(
+            1j * (self._phases[audible] - w * self.hop))
+        vals = vals[:, None] * hann_spectrum(theta, size)
+
+        # the parts falling on negative bins or beyond Nyquist belong to
+        # the mirrored spectrum of the real signal
+        mirrored = (bins < 0) | (bins > size // 2)
+        vals = np.where(mirrored, vals.conj(), vals).ravel()
+        bins = np.where(bins < 0, -bins, bins)
+        bins = np.where(bins > size // 2, size - bins, bins).ravel()
+        spectrum = np.bincount(bins, vals.real, size // 2 + 1) + \
+            1j * np.bincount(bins, vals.imag, size // 2 + 1)
+        # DC and Nyquist collect both halves of the spectrum
+        spectrum[0] *= 2
+        spectrum[-1] *= 2
+
+        self._phases = (self._phases + omega * self.hop) % (2 * math.pi)
+        return np.fft.irfft(spectrum, size)
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        assert phase is None, 'AdditiveOscillator has no phase modulation'
+        if freq is not None:
+            # partial frequencies only change from frame to frame
+            self.freq = freq[-1]
+            frame_freq = freq.mean()
+        else:
+            frame_freq = self._f
+        if self._tail is None:
+            # the first frame is centred on the first sample
+            self._tail = self._frame(frame_freq)[self.hop:]
+        blocks = [self._ready]
+        have = len(self._ready)
+        while have < n:
+            frame = self._frame(frame_freq)
+            blocks.append(self._tail + frame[:self.hop])
+            self._tail = frame[self.hop:]
+            have += self.hop
+        out = np.concatenate(blocks)
+        self._ready = out[n:]
+        return self._apply_amp(out[:n], amp)
@@ -1,7 +1,8 @@
+import argparse
 import signal
 import sys
+import time
 
-import numpy as np
 import pyaudio
 import PyQt6.QtWidgets as qtw
 import pyqtgraph as pg
@@ -9,44 +10,59 @@ from pygame import midi
 from PyQt6.QtCore import Qt
 from pyqtgraph.Qt import QtCore
 
-from envelope import Envelope
+from config import EngineConfig, add_config_arguments, config_from_args
+from engine import Patch, to_int16
+from engine_process import EngineProcess
 from midi import MidiThread, ProgramSignals, initialize_midi
-from oscillators import (Chain, ModulatedOscillator, ModulatedVolume,
-                         WaveAdder, amp_mod, freq_mod, get_osc_by_type,
-                         lowpass_filter)
+from multitimbral import Multitimbral, load_parts
 from widgets import ADSRWidget, LabelDial, SpectrogramWidget, WaveWidget
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
-RATE = 22_050
-buf_size = 256
-
 
 class Window(qtw.QMainWindow):
 
-    def __init__(self):
+    def __init__(self, config=None, engine_process=False, reverb=None,
+                 parts=None):
         super().__init__()
 
-        self.setup_midi()
-
-        self.base_f = 440
-        self.wave_type = 'sine'
-        self.lfo_wave_type = 'sine'
+        self.config = config if config is not None else EngineConfig()
+        print(self.config)
+        # the dials edit MIDI channel 1; the parts file sets up the others
+        self.patch = Patch()
+        patches, budgets = load_parts(parts) if parts else ({}, {})
+        # the limiter keeps polyphonic chords from clipping the int16 output
+        master = Patch(reverb_ir=reverb, limiter=True)
+        if engine_process:
+            # the engine process plays the audio itself
+            self.engine = EngineProcess(self.patch, self.config,
+                                        patches=patches,
+                                        budgets=budgets,
+                                        master=master)
+            self.stream = None
+            self.controller = None
+        else:
+            self.config.prepare([self.patch, master, *patches.values()])
+            self.engine = Multitimbral(self.patch, patches, budgets, master,
+                                       **self.config.synth_args())
+            self.controller = self.config.block_size_controller()
+            self.stream = pyaudio.PyAudio().open(
+                rate=self.config.sample_rate,
+                channels=self.config.channels,
+                format=pyaudio.paInt16,
+                output=True,
+                frames_per_buffer=self.config.block_size)
         self.wave_ptr = 0
 
+        self.setup_midi()
+
         self.setGeometry(100, 100, 1300, 600)
         self.build_ui_components()
 
-        self.stream = pyaudio.PyAudio().open(rate=RATE,
-                                             channels=1,
-                                             format=pyaudio.paInt16,
-                                             output=True,
-                                             frames_per_buffer=buf_size)
-        self.osc = None
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_buffer)
-        print('timer', buf_size / RATE * 1000)
-        self.timer.start(buf_size / RATE * 1000)
+        print('timer', self.config.period * 1000)
+        self.timer.start(int(self.config.period * 1000))
 
         self.show()
 
@@ -71,7 +87,9 @@ class Window(qtw.QMainWindow):
 
         # osc1/2
         n_selectors = 2
-        wave_list = ['sine', 'square', 'sawtooth', 'triangle']
+        wave_list = [
+            'sine', 'square', 'sawtooth', 'triangle', 'white', 'pink', 'brown'
+        ]
         toggle_events = [self.on_osc1_selected, self.on_lfo_wave_selected]
         btn_groups = []
         for i in range(n_selectors):
@@ -90,6 +108,10 @@ class Window(qtw.QMainWindow):
                 rad.toggled.connect(toggle_events[i])
                 layout_wave_select.addWidget(rad)
 
+        lfo_global = qtw.QCheckBox('Global LFO')
+        lfo_global.toggled.connect(self.on_lfo_global_toggled)
+        layout_wave_select.addWidget(lfo_global)
+
         layout_left.addLayout(layout_wave_select)
 
         # Wave plot
@@ -97,11 +119,14 @@ class Window(qtw.QMainWindow):
         layout_plot.addWidget(self.wave_plot)
 
         # Spectrogram plot
-        self.spec_plot = SpectrogramWidget(sample_rate=RATE, buf_size=buf_size)
+        self.spec_plot = SpectrogramWidget(
+            sample_rate=self.config.sample_rate,
+            buf_size=self.config.block_size)
         layout_plot.addWidget(self.spec_plot)
 
         # ADSR plot
-        self.adsr_plot = ADSRWidget(sample_rate=RATE, buf_size=buf_size)
+        self.adsr_plot = ADSRWidget(sample_rate=self.config.sample_rate,
+                                    buf_size=self.config.block_size)
         layout_plot.addWidget(self.adsr_plot)
 
         # Set plots
@@ -124,6 +149,30 @@ class Window(qtw.QMainWindow):
             layout_dials.addLayout(self.adsr[adsr_type])
         self.update_adsr_dial()
 
+        # unison of OSC1
+        self.unison = {}
+        for unison_type, init_value, range_min, range_max in [
+            ('Unison', 1, 1, 16),
+            ('Detune', 20, 0, 100),
+            ('Spread', 100, 0, 100),
+        ]:
+            label_dial = LabelDial(text=unison_type,
+                                   range_min=range_min,
+                                   range_max=range_max,
+                                   value_changed=self.update_unison_dial)
+            self.unison[unison_type] = label_dial
+            label_dial.dial.setValue(init_value)
+            layout_dials.addLayout(label_dial)
+        self.update_unison_dial()
+
+        # portamento
+        self.glide = LabelDial(text='Glide',
+                               range_min=0,
+                               range_max=1000,
+                               value_changed=self.update_glide_dial)
+        layout_dials.addLayout(self.glide)
+        self.update_glide_dial()
+
         # LFO
         self.lfo = {}
         for lfo_type, init_value, range_min, range_max in [('LFO Freq', 0, 0,
@@ -163,19 +212,31 @@ class Window(qtw.QMainWindow):
         pg.setConfigOptions(antialias=True)
 
     def update_buffer(self):
-        if not self.osc:
-            return
-
-        buf = np.array([next(self.osc) for _ in range(buf_size)])
-        buf = lowpass_filter(wave=buf,
-                             sample_rate=RATE,
-                             cutoff=self.cutoff,
-                             order=5,
-                             lpf_intensity=self.lpf_intensity)
-
-        samples = np.int16([b * 32767 for b in buf]).tobytes()
-        self.stream.write(samples)
-
+        if self.stream is None:
+            buf = self.engine.latest_frame()
+            if buf is None:
+                return
+        else:
+            if not self.engine.active:
+                return
+
+            if self.controller is None:
+                buf = self.engine.render(self.config.block_size)
+            else:
+                n = self.controller.block_size
+                start = time.perf_counter()
+                buf = self.engine.render(n)
+                if self.controller.update(time.perf_counter() - start, n):
+                    self.timer.setInterval(
+                        int(self.controller.block_size /
+                            self.config.sample_rate * 1000))
+
+            samples = to_int16(buf, self.config.channels).tobytes()
+            self.stream.write(samples)
+
+        if buf.ndim == 2:
+            # the plots show the mono mix
+            buf = buf.mean(axis=0)
         self.wave_plot.curve.setData(buf)
         self.spec_plot.update(buf)
 
@@ -183,118 +244,117 @@ class Window(qtw.QMainWindow):
         for adsr_type, widget in self.adsr.items():
             val = widget.dial.value()
             if adsr_type == 'Attack':
-                self.attack_duration = val / 1000
+                self.engine.set_param('attack_duration', val / 1000)
                 self.adsr[adsr_type].label.setText(
-                    f'Attack\n{self.attack_duration*1000:.1f}ms')
+                    f'Attack\n{self.patch.attack_duration*1000:.1f}ms')
             elif adsr_type == 'Decay':
-                self.decay_duration = val / 1000
+                self.engine.set_param('decay_duration', val / 1000)
                 self.adsr[adsr_type].label.setText(
-                    f'Decay\n{self.decay_duration*1000:.1f}ms')
+                    f'Decay\n{self.patch.decay_duration*1000:.1f}ms')
             elif adsr_type == 'Sustain':
-                self.sustain_level = val / 1000
+                self.engine.set_param('sustain_level', val / 1000)
                 self.adsr[adsr_type].label.setText(
-                    f'Sustain\n{self.sustain_level:.2f}')
+                    f'Sustain\n{self.patch.sustain_level:.2f}')
             elif adsr_type == 'Release':
-                self.release_duration = val / 1000
+                self.engine.set_param('release_duration', val / 1000)
                 self.adsr[adsr_type].label.setText(
-                    f'Release\n{self.release_duration*1000:.1f}ms')
-
-        try:
-            self.env = Envelope(attack_duration=self.attack_duration,
-                                decay_duration=self.decay_duration,
-                                sustain_level=self.sustain_level,
-                                release_duration=self.release_duration,
-                                sample_rate=RATE)
-            self.adsr_plot.curve.setData(self.env.get_shape())
-        except AttributeError as e:
-            pass
+                    f'Release\n{self.patch.release_duration*1000:.1f}ms')
+
+        self.adsr_plot.set_envelope(self.patch.attack_duration,
+                                    self.patch.decay_duration,
+                                    self.patch.sustain_level,
+                                    self.patch.release_duration)
+
+    def update_unison_dial(self):
+        for unison_type, widget in self.unison.items():
+            val = widget.dial.value()
+            if unison_type == 'Unison':
+                self.engine.set_param('unison', val)
+                widget.label.setText(f'Unison\n{val}')
+            elif unison_type == 'Detune':
+                self.engine.set_param('unison_detune', val)
+                widget.label.setText(f'Detune\n{val} cents')
+            elif unison_type == 'Spread':
+                # stereo width, heard with --channels 2
+                self.engine.set_param('unison_spread', val / 100)
+                widget.label.setText(f'Spread\n{val}%')
+
+    def update_glide_dial(self):
+        val = self.glide.dial.value()
+        self.engine.set_param('glide', val / 1000)
+        self.glide.label.setText(f'Glide\n{val}ms')
 
     def update_lfo_dial(self):
         for lfo_type, widget in self.lfo.items():
             val = widget.dial.value()
             if lfo_type == 'LFO Freq':
-                self.lfo_freq = val
+                self.engine.set_param('lfo_freq', val)
                 widget.label.setText(f'LFO Freq\n{val} Hz')
 
     def update_lpf_dial(self):
         for lpf_type, widget in self.lpf.items():
             val = widget.dial.value()
             if lpf_type == 'Cutoff':
-                self.cutoff = val
+                self.engine.set_param('cutoff', val)
                 if val == 0:
                     val = '-'
                 widget.label.setText(f'Cutoff\n{val} Hz')
             elif lpf_type == 'LPF Intensity':
-                self.lpf_intensity = val / 100
+                self.engine.set_param('lpf_intensity', val / 100)
                 widget.label.setText(
-                    f'LPF Intensity\n{self.lpf_intensity:.1f}')
+                    f'LPF Intensity\n{self.patch.lpf_intensity:.1f}')
 
     def on_osc1_selected(self):
         radio_button = self.sender()
         if radio_button.isChecked():
             print("You have selected : " + radio_button.text())
-            self.wave_type = radio_button.text()
+            self.engine.set_param('wave_type', radio_button.text())
 
     def on_lfo_wave_selected(self):
         radio_button = self.sender()
         if radio_button.isChecked():
             print('lfo', radio_button.text())
-            self.lfo_wave_type = radio_button.text()
+            self.engine.set_param('lfo_wave_type', radio_button.text())
 
-    def note_on(self):
-        sample_rate = RATE
-        print('note on base f', self.base_f)
-        if self.lfo_freq == 0:
-            osc = ModulatedOscillator(
-                get_osc_by_type(self.wave_type,
-                                freq=self.base_f,
-                                sample_rate=sample_rate), )
+    def on_lfo_global_toggled(self, checked):
+        self.engine.set_param('lfo_global', checked)
 
-        else:
-            osc = ModulatedOscillator(
-                get_osc_by_type(self.wave_type,
-                                freq=self.base_f,
-                                sample_rate=sample_rate),
-                get_osc_by_type(self.lfo_wave_type,
-                                freq=self.lfo_freq,
-                                sample_rate=sample_rate,
-                                wave_range=(0.2, 1.0)),
-                amp_mod=amp_mod,
-                freq_mod=freq_mod,
-            )
-
-        self.osc = iter(
-            WaveAdder(
-                Chain(
-                    osc,
-                    ModulatedVolume(
-                        Envelope(
-                            attack_duration=self.attack_duration,
-                            decay_duration=self.decay_duration,
-                            sustain_level=self.sustain_level,
-                            release_duration=self.release_duration,
-                            sample_rate=sample_rate,
-                        )),
-                ),
-                stereo=False,
-            ))
-
-    def note_off(self):
-        self.osc.trigger_note_release()
+    def closeEvent(self, event):
+        if self.stream is None:
+            self.engine.close()
+        super().closeEvent(event)
 
     def on_midi_message(self, event):
-        status, note, freq = event
-        if status == 0x90:  # note on
-            self.base_f = freq
-            self.note_on()
-        elif status == 0x80:  # note off
-            self.note_off()
+        status, note, freq, vel = event
+        kind, channel = status & 0xF0, status & 0x0F
+        if kind == 0x90 and vel > 0:  # note on
+            print('note on base f', freq)
+            self.engine.note_on(freq, note=note, velocity=vel,
+                                channel=channel)
+        elif kind in (0x80, 0x90):  # note off
+            self.engine.note_off(note=note, channel=channel)
+        elif kind == 0xB0:  # control change
+            self.engine.control_change(note, vel, channel=channel)
+        elif kind == 0xE0:  # pitch bend, LSB and MSB
+            self.engine.pitch_bend(note | vel << 7, channel=channel)
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine-process', action='store_true',
+                        help='run the synth engine in its own process')
+    parser.add_argument('--reverb',
+                        help='impulse response WAV of the convolution reverb')
+    parser.add_argument('--parts',
+                        help='JSON file of patches by MIDI channel')
+    add_config_arguments(parser)
+    args, qt_args = parser.parse_known_args()
     try:
-        App = qtw.QApplication(sys.argv)
-        window = Window()
+        App = qtw.QApplication(sys.argv[:1] + qt_args)
+        window = Window(config_from_args(args),
+                        engine_process=args.engine_process,
+                        reverb=args.reverb,
+                        parts=args.parts)
         sys.exit(App.exec())
     except KeyboardInterrupt as e:
         sys.exit()
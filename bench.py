@@ -0,0 +1,368 @@
+"""Performance benchmarks for the synth engine.
+
+    python bench.py batch-scaling jobs.json
+    python bench.py voices --threads 4
+    python bench.py jitter
+    python bench.py lfo
+    python bench.py unison
+    python bench.py additive
+    python bench.py effects
+    python bench.py oversampling
+
+Each subcommand prints a small table; nothing here is needed to run the
+app.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+def bench_batch_scaling(args):
+    from config import EngineConfig
+    from render import load_jobs, render_batch
+
+    max_workers = args.max_workers or os.cpu_count()
+    print(f'{"workers":>8} {"wall [s]":>9} {"x realtime":>11} '
+          f'{"speedup":>8} {"efficiency":>11}')
+    base = None
+    with tempfile.TemporaryDirectory() as out_dir:
+        jobs = load_jobs(args.jobs, out_dir)
+        for workers in range(1, max_workers + 1):
+            manifest = render_batch(jobs,
+                                    workers=workers,
+                                    config=EngineConfig(
+                                        sample_rate=args.rate,
+                                        block_size=args.block_size))
+            wall = manifest['wall_seconds']
+            base = base or wall
+            speedup = base / wall
+            print(f'{workers:>8} {wall:>9.2f} '
+                  f'{manifest["realtime_factor"]:>11.1f} {speedup:>8.2f} '
+                  f'{speedup / workers:>11.2f}')
+
+
+def bench_voices(args):
+    from engine import Patch, Synth
+
+    patch = Patch(wave_type='sawtooth', lfo_freq=5, cutoff=3000)
+    deadline = args.block_size / args.rate * 1000
+    print(f'block {args.block_size} @ {args.rate} Hz, '
+          f'deadline {deadline:.2f} ms, {args.threads} threads')
+    print(f'{"voices":>7} {"1 thread [ms]":>14} {"p99":>7} '
+          f'{"parallel [ms]":>14} {"p99":>7}')
+    for n_voices in args.voices:
+        row = []
+        for threads in (1, args.threads):
+            synth = Synth(patch, sample_rate=args.rate, max_voices=n_voices,
+                          threads=threads)
+            for i in range(n_voices):
+                synth.note_on(110 * 2**(i / 12), note=i)
+            synth.render(args.block_size)
+            times = []
+            for _ in range(args.blocks):
+                start = time.perf_counter()
+                synth.render(args.block_size)
+                times.append((time.perf_counter() - start) * 1000)
+            synth.close()
+            row += [np.mean(times), np.percentile(times, 99)]
+        print(f'{n_voices:>7} {row[0]:>14.3f} {row[1]:>7.3f} '
+              f'{row[2]:>14.3f} {row[3]:>7.3f}')
+
+
+def _gui_load(ms):
+    # pure Python work standing in for pyqtgraph drawing; holds the GIL
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        sum(i * i for i in range(200))
+
+
+def _jitter_stats(lateness):
+    lateness = np.array(lateness) * 1000
+    return (f'mean {lateness.mean():6.3f} ms  p99 '
+            f'{np.percentile(lateness, 99):6.3f} ms  max '
+            f'{lateness.max():6.3f} ms')
+
+
+def bench_jitter(args):
+    from config import EngineConfig
+    from engine import Patch, Synth
+    from engine_process import EngineProcess
+
+    patch = Patch(wave_type='sawtooth', lfo_freq=5, cutoff=3000)
+    period = args.block_size / args.rate
+    n_blocks = int(args.seconds / period)
+    draw_every = 1 / args.fps
+    print(f'{args.voices} voices, block {args.block_size} @ {args.rate} Hz, '
+          f'{args.draw_ms} ms of drawing at {args.fps} fps')
+
+    # In-process, as the app runs by default: one thread renders each block
+    # when it is due and also draws.
+    synth = Synth(patch, sample_rate=args.rate, max_voices=args.voices)
+    for i in range(args.voices):
+        synth.note_on(110 * 2**(i / 12), note=i)
+    lateness = []
+    start = time.perf_counter()
+    next_draw = start
+    for k in range(1, n_blocks + 1):
+        deadline = start + k * period
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        synth.render(args.block_size)
+        lateness.append(max(time.perf_counter() - deadline, 0))
+        if time.perf_counter() >= next_draw:
+            _gui_load(args.draw_ms)
+            next_draw += draw_every
+    print(f'in-process      {_jitter_stats(lateness)}')
+
+    # Engine process: this process only draws.
+    engine = EngineProcess(patch,
+                           EngineConfig(sample_rate=args.rate,
+                                        block_size=args.block_size),
+                           max_voices=args.voices,
+                           audio=False)
+    for i in range(args.voices):
+        engine.note_on(110 * 2**(i / 12), note=i)
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        engine.latest_frame()
+        _gui_load(args.draw_ms)
+        time.sleep(max(draw_every - args.draw_ms / 1000, 0))
+    stats = engine.close()
+    print(f'engine process  {_jitter_stats(stats["lateness"])}')
+
+
+def bench_lfo(args):
+    from engine import Patch, Synth
+
+    print(f'block {args.block_size} @ {args.rate} Hz')
+    print(f'{"voices":>7} {"per-voice LFO [ms]":>19} {"global LFO [ms]":>16}')
+    for n_voices in args.voices:
+        row = []
+        for lfo_global in (False, True):
+            patch = Patch(lfo_freq=5, lfo_global=lfo_global,
+                          sustain_level=1.0)
+            synth = Synth(patch, sample_rate=args.rate, max_voices=n_voices)
+            for i in range(n_voices):
+                synth.note_on(110 * 2**(i / 12), note=i)
+            start = time.perf_counter()
+            for _ in range(args.blocks):
+                synth.render(args.block_size)
+            row.append((time.perf_counter() - start) / args.blocks * 1000)
+        print(f'{n_voices:>7} {row[0]:>19.3f} {row[1]:>16.3f}')
+
+
+def bench_unison(args):
+    from oscillators import SawtoothOscillator, UnisonOscillator
+
+    n = args.block_size
+    print(f'block {n} @ {args.rate} Hz')
+    print(f'{"copies":>7} {"per-sample saws [ms]":>21} {"unison [ms]":>12} '
+          f'{"speedup":>8}')
+    for voices in args.voices:
+        saws = [
+            iter(SawtoothOscillator(220 * 2**(c / 1200),
+                                    sample_rate=args.rate))
+            for c in np.linspace(-10, 10, voices)
+        ]
+        start = time.perf_counter()
+        for _ in range(args.blocks):
+            buf = np.zeros(n)
+            for saw in saws:
+                buf += [next(saw) for _ in range(n)]
+        per_sample = (time.perf_counter() - start) / args.blocks * 1000
+
+        unison = iter(UnisonOscillator('sawtooth', 220, sample_rate=args.rate,
+                                       voices=voices))
+        start = time.perf_counter()
+        for _ in range(args.blocks):
+            unison.render(n)
+        block = (time.perf_counter() - start) / args.blocks * 1000
+        print(f'{voices:>7} {per_sample:>21.3f} {block:>12.3f} '
+              f'{per_sample / block:>8.1f}')
+
+
+def bench_additive(args):
+    from additive import AdditiveOscillator
+    from oscillators import SineOscillator, WaveAdder
+
+    n = args.block_size
+    freq = 20
+    print(f'block {n} @ {args.rate} Hz, harmonics of {freq} Hz')
+    print(f'{"partials":>9} {"per-sample adder [ms]":>22} '
+          f'{"block adder [ms]":>17} {"additive [ms]":>14}')
+    for partials in args.partials:
+        sines = [
+            SineOscillator(freq * k, sample_rate=args.rate)
+            for k in range(1, partials + 1)
+        ]
+        row = []
+        adder = iter(WaveAdder(*sines))
+        blocks = max(args.blocks * 16 // partials, 1)
+        start = time.perf_counter()
+        for _ in range(blocks):
+            [next(adder) for _ in range(n)]
+        row.append((time.perf_counter() - start) / blocks * 1000)
+
+        adder = iter(WaveAdder(*sines))
+        start = time.perf_counter()
+        for _ in range(args.blocks):
+            adder.render(n)
+        row.append((time.perf_counter() - start) / args.blocks * 1000)
+
+        bank = iter(AdditiveOscillator(freq, n_partials=partials,
+                                       sample_rate=args.rate))
+        start = time.perf_counter()
+        for _ in range(args.blocks):
+            bank.render(n)
+        row.append((time.perf_counter() - start) / args.blocks * 1000)
+        print(f'{partials:>9} {row[0]:>22.3f} {row[1]:>17.3f} '
+              f'{row[2]:>14.3f}')
+
+
+def bench_effects(args):
+    from dynamics import Compressor, Limiter
+    from effects import Chorus, ConvolutionReverb, FDNReverb, TempoDelay
+
+    rate = args.rate
+    ir = np.random.default_rng(0).standard_normal(3 * rate) * np.exp(
+        -np.arange(3 * rate) / (0.5 * rate))
+    effects = {
+        'chorus': lambda n: Chorus(rate),
+        'tempo delay': lambda n: TempoDelay(rate),
+        'fdn reverb': lambda n: FDNReverb(rate),
+        'conv reverb 3s': lambda n: ConvolutionReverb(ir, block_size=n),
+        'compressor': lambda n: Compressor(rate),
+        'limiter': lambda n: Limiter(rate),
+    }
+    rng = np.random.default_rng(1)
+    print(f'{rate} Hz, ms per block (share of the block duration)')
+    print(f'{"effect":>15}' + ''.join(f'{n:>16}' for n in args.block_sizes))
+    for name, make in effects.items():
+        row = []
+        for n in args.block_sizes:
+            effect = make(n)
+            block = rng.standard_normal((args.channels, n))
+            effect(block)
+            start = time.perf_counter()
+            for _ in range(args.blocks):
+                effect(block)
+            ms = (time.perf_counter() - start) / args.blocks * 1000
+            row.append(f'{ms:>8.3f} ({ms / (n / rate * 1000):>4.0%})')
+        print(f'{name:>15}' + ''.join(f'{cell:>16}' for cell in row))
+
+
+def bench_oversampling(args):
+    from engine import Patch, Synth
+
+    patch = Patch(wave_type='sawtooth', sustain_level=1.0, cutoff=3000)
+    deadline = args.block_size / args.rate * 1000
+    print(f'{args.voices} voices, block {args.block_size} @ {args.rate} Hz, '
+          f'deadline {deadline:.2f} ms')
+    print(f'{"factor":>7} {"block [ms]":>11} {"p99":>7} {"load":>6} '
+          f'{"cost":>6}')
+    base = None
+    for factor in args.factors:
+        synth = Synth(patch, sample_rate=args.rate, max_voices=args.voices,
+                      oversample=factor)
+        for i in range(args.voices):
+            synth.note_on(110 * 2**(i / 12), note=i)
+        synth.render(args.block_size)
+        times = []
+        for _ in range(args.blocks):
+            start = time.perf_counter()
+            synth.render(args.block_size)
+            times.append((time.perf_counter() - start) * 1000)
+        mean = np.mean(times)
+        base = base or mean
+        print(f'{factor:>6}x {mean:>11.3f} {np.percentile(times, 99):>7.3f} '
+              f'{mean / deadline:>6.0%} {mean / base:>5.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='bench', required=True)
+
+    p = subparsers.add_parser('batch-scaling',
+                              help='batch render time from 1 to N workers')
+    p.add_argument('jobs', help='JSON job list, as for render.py --batch')
+    p.add_argument('--max-workers', type=int)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=4096)
+    p.set_defaults(func=bench_batch_scaling)
+
+    p = subparsers.add_parser('voices',
+                              help='per-block latency against voice count')
+    p.add_argument('--voices', type=int, nargs='+',
+                   default=[1, 2, 4, 8, 16, 32, 64])
+    p.add_argument('--threads', type=int, default=os.cpu_count())
+    p.add_argument('--blocks', type=int, default=200)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_voices)
+
+    p = subparsers.add_parser('jitter',
+                              help='block lateness with the engine in the '
+                              'GUI process and in its own process')
+    p.add_argument('--voices', type=int, default=8)
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--draw-ms', type=float, default=15,
+                   help='simulated drawing time per frame')
+    p.add_argument('--fps', type=float, default=30)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_jitter)
+
+    p = subparsers.add_parser('lfo',
+                              help='block time with per-voice and global LFO')
+    p.add_argument('--voices', type=int, nargs='+', default=[1, 4, 16, 64])
+    p.add_argument('--blocks', type=int, default=200)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_lfo)
+
+    p = subparsers.add_parser('unison',
+                              help='unison block rendering against one '
+                              'per-sample oscillator per copy')
+    p.add_argument('--voices', type=int, nargs='+', default=[1, 3, 7, 16])
+    p.add_argument('--blocks', type=int, default=50)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_unison)
+
+    p = subparsers.add_parser('additive',
+                              help='IFFT additive bank against a WaveAdder '
+                              'of sine oscillators')
+    p.add_argument('--partials', type=int, nargs='+',
+                   default=[16, 64, 256, 1024])
+    p.add_argument('--blocks', type=int, default=50)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_additive)
+
+    p = subparsers.add_parser('effects', help='per-block cost of the effects')
+    p.add_argument('--block-sizes', type=int, nargs='+',
+                   default=[64, 256, 1024])
+    p.add_argument('--channels', type=int, default=1)
+    p.add_argument('--blocks', type=int, default=200)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.set_defaults(func=bench_effects)
+
+    p = subparsers.add_parser('oversampling',
+                              help='block time per oversampling factor')
+    p.add_argument('--factors', type=int, nargs='+', default=[1, 2, 4])
+    p.add_argument('--voices', type=int, default=8)
+    p.add_argument('--blocks', type=int, default=200)
+    p.add_argument('--rate', type=int, default=22_050)
+    p.add_argument('--block-size', type=int, default=256)
+    p.set_defaults(func=bench_oversampling)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
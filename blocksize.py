@@ -0,0 +1,70 @@
+"""Adaptive block size driven by measured render time.
+
+A block of n samples has to be rendered in less than n / sample_rate
+seconds, its deadline. BlockSizeController keeps the ratio of the two, the
+load, over the last ``window`` blocks. When the slowest of them goes over
+``high`` it doubles the block size and deepens the audio ring by one block,
+so a slow block has more time and more queued audio to hide behind. When
+every one of them is under ``low`` it halves the block size and takes a
+block off the ring again, which lowers the latency. The gap between the
+two thresholds and a pause of ``cooldown`` blocks after each change keep
+it from going back and forth.
+"""
+import collections
+
+
+class BlockSizeController:
+
+    def __init__(self, sample_rate, min_size, max_size, min_depth=2,
+                 max_depth=4, high=0.6, low=0.2, window=32, cooldown=64):
+        assert 0 < min_size <= max_size, \
+            f'Bad block size range {min_size}-{max_size}'
+        assert 0 < min_depth <= max_depth, \
+            f'Bad ring depth range {min_depth}-{max_depth}'
+        assert low < high, 'low must be below high'
+        self.sample_rate = sample_rate
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.high = high
+        self.low = low
+        self.cooldown = cooldown
+        self.block_size = min_size
+        self.depth = min_depth
+        self._loads = collections.deque(maxlen=window)
+        self._wait = 0
+
+    @property
+    def latency(self):
+        """Seconds of audio queued when the ring is full."""
+        return self.block_size * self.depth / self.sample_rate
+
+    def update(self, render_seconds, n):
+        """Record that a block of ``n`` samples took ``render_seconds`` and
+        return True if block_size or depth changed."""
+        self._loads.append(render_seconds * self.sample_rate / n)
+        if self._wait > 0:
+            self._wait -= 1
+            return False
+        if len(self._loads) < self._loads.maxlen:
+            return False
+
+        load = max(self._loads)
+        size, depth = self.block_size, self.depth
+        if load > self.high:
+            size = min(size * 2, self.max_size)
+            depth = min(depth + 1, self.max_depth)
+        elif load < self.low:
+            size = max(size // 2, self.min_size)
+            depth = max(depth - 1, self.min_depth)
+        if (size, depth) == (self.block_size, self.depth):
+            return False
+
+        print(f'block size {self.block_size} -> {size}, ring depth '
+              f'{self.depth} -> {depth} at load {load:.0%}, latency '
+              f'{size * depth / self.sample_rate * 1000:.1f} ms')
+        self.block_size, self.depth = size, depth
+        self._loads.clear()
+        self._wait = self.cooldown
+        return True
@@ -0,0 +1,125 @@
+"""Engine configuration chosen at startup.
+
+EngineConfig holds the sample rate, block size, output channels and voice
+oversampling factor that the app, the engine process and the renderer
+share. It is read from a JSON file, e.g.
+
+    {"sample_rate": 48000, "block_size": 64}
+
+and command line flags override the file. Everything that depends on the
+rate is built from it in prepare(), before audio starts.
+
+With a ``max_block_size`` the live engine adapts its block size between
+the two to the load (see blocksize.py).
+"""
+import json
+
+from blocksize import BlockSizeController
+from engine import fade_out_table, warm_caches
+
+FIELDS = ('sample_rate', 'block_size', 'channels', 'oversample',
+          'max_block_size')
+
+
+def read_settings(path):
+    with open(path) as f:
+        settings = json.load(f)
+    unknown = set(settings) - set(FIELDS)
+    assert not unknown, f'Unknown settings in {path}: {sorted(unknown)}'
+    return settings
+
+
+class EngineConfig:
+
+    def __init__(self, sample_rate=22_050, block_size=256, channels=1,
+                 oversample=1, max_block_size=None):
+        assert sample_rate > 0, f'Bad sample rate {sample_rate}'
+        assert block_size > 0, f'Bad block size {block_size}'
+        assert channels in (1, 2), f'{channels} channels, 1 or 2 supported'
+        assert oversample in (1, 2, 4), f'Oversampling {oversample}x, ' \
+            '1x, 2x or 4x supported'
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.channels = channels
+        self.oversample = oversample
+        if max_block_size is not None:
+            assert max_block_size >= block_size, \
+                f'Max block size {max_block_size} below {block_size}'
+        self.max_block_size = max_block_size
+
+    @classmethod
+    def from_file(cls, path, **overrides):
+        return cls(**dict(read_settings(path), **overrides))
+
+    @property
+    def voice_rate(self):
+        return self.sample_rate * self.oversample
+
+    @property
+    def period(self):
+        """Duration of a block in seconds."""
+        return self.block_size / self.sample_rate
+
+    @property
+    def largest_block(self):
+        return self.max_block_size or self.block_size
+
+    def block_size_controller(self, max_depth=4):
+        """BlockSizeController from block_size to max_block_size, or None
+        for a fixed block size."""
+        if self.max_block_size is None:
+            return None
+        return BlockSizeController(self.sample_rate,
+                                   self.block_size,
+                                   self.max_block_size,
+                                   min_depth=min(2, max_depth),
+                                   max_depth=max_depth)
+
+    def synth_args(self):
+        """Keyword arguments of Synth for this configuration."""
+        return dict(sample_rate=self.sample_rate,
+                    block_size=self.block_size,
+                    oversample=self.oversample,
+                    channels=self.channels)
+
+    def prepare(self, patches=()):
+        """Build the rate-dependent tables: the voices' fade table, filter
+        coefficients, sample libraries and wavetables of ``patches``."""
+        fade_out_table(self.voice_rate)
+        warm_caches(patches, self.sample_rate)
+
+    def __repr__(self):
+        blocks = f'{self.block_size}'
+        if self.max_block_size is not None:
+            blocks += f'-{self.max_block_size}'
+        return (f'EngineConfig({self.sample_rate} Hz, {blocks} samples, '
+                f'{self.channels} ch, {self.oversample}x)')
+
+
+def add_config_arguments(parser):
+    parser.add_argument('--config', help='JSON file of engine settings')
+    parser.add_argument('--rate', type=int, help='sample rate in Hz')
+    parser.add_argument('--block-size', type=int,
+                        help='samples rendered per block')
+    parser.add_argument('--max-block-size', type=int,
+                        help='let the block size grow up to this under load')
+    parser.add_argument('--channels', type=int, choices=[1, 2])
+    parser.add_argument('--oversample', type=int, choices=[1, 2, 4],
+                        help='render the voices at this multiple of the rate')
+
+
+def config_from_args(args, **defaults):
+    """EngineConfig of ``defaults``, then the --config file, then flags."""
+    flags = {
+        'sample_rate': args.rate,
+        'block_size': args.block_size,
+        'channels': args.channels,
+        'oversample': args.oversample,
+        'max_block_size': args.max_block_size,
+    }
+    values = dict(defaults)
+    if args.config is not None:
+        values.update(read_settings(args.config))
+    values.update(
+        {name: value for name, value in flags.items() if value is not None})
+    return EngineConfig(**values)
@@ -0,0 +1,151 @@
+"""Master bus dynamics: a compressor and a true-peak look-ahead limiter.
+
+Both work on whole blocks. Levels come from a sliding-window max over the
+block and a few samples of history. Gain curves are computed as arrays:
+a moving average over the attack time ramps the gain down, and a
+one-pole filter run with lfilter lets it recover over the release time.
+Channels share one gain, so the stereo image does not move.
+
+Like the effects (see effects.py) they take (n,) or (channels, n) blocks.
+``latency`` is the delay they add to the signal in samples.
+``gain_reduction`` is the largest gain reduction of the last block in dB
+and ``max_gain_reduction`` is the largest one so far.
+"""
+import math
+
+import numpy as np
+import scipy.signal
+from numpy.lib.stride_tricks import sliding_window_view
+
+OVERSAMPLE = 4
+TRUE_PEAK_TAPS = 49  # odd, so the interpolator delays by whole samples
+
+
+def db_to_gain(db):
+    return 10**(db / 20)
+
+
+class _Dynamics:
+
+    latency = 0
+
+    def __init__(self, sample_rate, attack, release):
+        self.sample_rate = sample_rate
+        self.attack = max(int(attack * sample_rate), 1)
+        self._release = math.exp(-1 / max(release * sample_rate, 1))
+        self._zi = np.array([self._release])
+        self._gains = np.ones(self.attack)
+        self.gain_reduction = 0.
+        self.max_gain_reduction = 0.
+
+    def _smooth(self, gains, history=None):
+        """Ramp ``gains`` down over the attack time and back up over the
+        release time; ``history`` are the target gains before them."""
+        if history is None:
+            history = self._gains
+            self._gains = np.concatenate((history, gains))[-self.attack:]
+        ramped = sliding_window_view(np.concatenate((history, gains)),
+                                     self.attack + 1).mean(axis=1)
+        released, self._zi = scipy.signal.lfilter([1 - self._release],
+                                                  [1, -self._release],
+                                                  ramped,
+                                                  zi=self._zi)
+        gains = np.minimum(ramped, released)
+        self.gain_reduction = -20 * math.log10(max(gains.min(), 1e-9))
+        self.max_gain_reduction = max(self.max_gain_reduction,
+                                      self.gain_reduction)
+        return gains
+
+    @property
+    def metrics(self):
+        return {
+            'latency_ms': self.latency / self.sample_rate * 1000,
+            'gain_reduction_db': self.gain_reduction,
+            'max_gain_reduction_db': self.max_gain_reduction,
+        }
+
+
+class Compressor(_Dynamics):
+    """Feed-forward compressor with a hard knee. Adds no latency."""
+
+    def __init__(self, sample_rate, threshold=-18., ratio=4., attack=0.005,
+                 release=0.15, makeup=0.):
+        super().__init__(sample_rate, attack, release)
+        self.threshold = threshold
+        self.ratio = ratio
+        self.makeup = makeup
+        self._peaks = np.zeros(self.attack)
+
+    @property
+    def idle(self):
+        return True
+
+    def __call__(self, buf):
+        x = np.atleast_2d(buf)
+        peaks = np.abs(x).max(axis=0)
+        window = np.concatenate((self._peaks, peaks))
+        self._peaks = window[-self.attack:]
+        level = sliding_window_view(window, self.attack + 1).max(axis=1)
+        over = 20 * np.log10(np.maximum(level, 1e-9)) - self.threshold
+        reduction = np.maximum(over, 0) * (1 - 1 / self.ratio)
+        gains = self._smooth(db_to_gain(-reduction))
+        out = x * (gains * db_to_gain(self.makeup))
+        return out[0] if buf.ndim == 1 else out
+
+
+class Limiter(_Dynamics):
+    """Look-ahead limiter holding true peaks under ``ceiling`` dBTP.
+
+    Inter-sample peaks are estimated by 4x oversampling with a
+    windowed-sinc interpolator, as in ITU-R BS.1770; content close to
+    Nyquist can still peak about half a dB higher. The gain needed for
+    every sample is brought forward by the look-ahead time with a
+    sliding-window min and ramped over the same time, so it reaches its
+    value exactly at the peak. The output is delayed by the look-ahead
+    time plus half the interpolator length.
+    """
+
+    def __init__(self, sample_rate, ceiling=-1., lookahead=0.0015,
+                 release=0.1):
+        super().__init__(sample_rate, lookahead, release)
+        self.ceiling = ceiling
+        self._taps = scipy.signal.firwin(TRUE_PEAK_TAPS,
+                                         1 / OVERSAMPLE) * OVERSAMPLE
+        self._delay = (TRUE_PEAK_TAPS - 1) // 2 // OVERSAMPLE
+        self.latency = self.attack + self._delay
+        self._history = None
+
+    @property
+    def idle(self):
+        return self._history is None or not self._history.any()
+
+    def true_peaks(self, x):
+        """Per-sample peak of (channels, n) ``x`` between this sample and
+        the next, valid from ``_delay`` samples after the start to as many
+        before the end."""
+        up = scipy.signal.upfirdn(self._taps, x, up=OVERSAMPLE, axis=1)
+        start = (TRUE_PEAK_TAPS - 1) // 2
+        up = up[:, start:start + OVERSAMPLE * x.shape[1]]
+        return np.abs(up).reshape(len(x), -1, OVERSAMPLE).max(axis=(0, 2))
+
+    def __call__(self, buf):
+        x = np.atleast_2d(buf)
+        L, d = self.attack, self._delay
+        H = 2 * L + 2 * d
+        if self._history is None or len(self._history) != len(x):
+            self._history = np.zeros((len(x), H))
+        if self.idle and not x.any():
+            return buf
+
+        n = x.shape[1]
+        z = np.concatenate((self._history, x), axis=1)
+        self._history = z[:, -H:]
+        peaks = np.maximum(self.true_peaks(z), 1e-9)
+        needed = np.minimum(db_to_gain(self.ceiling) / peaks, 1)
+        # the lowest gain any sample in the next L + 1 needs
+        ahead = sliding_window_view(needed, L + 1).min(axis=1)
+        start = H - 2 * L - d
+        gains = self._smooth(ahead[start + L:start + L + n],
+                             history=ahead[start:start + L])
+        out = z[:, H - L - d:H - L - d + n] * gains
+        return out[0] if buf.ndim == 1 else out
@@ -0,0 +1,333 @@
+"""Effects applied to the mixed synth output, after the filter.
+
+An effect is called with a block, shaped (n,) or (channels, n), and returns
+the processed block of the same shape. Its ``idle`` property says that the
+effect has no tail left to play, so a silent block may skip it.
+"""
+import numpy as np
+import scipy.linalg
+import scipy.signal
+
+from wavfile import WavFile
+
+
+def load_impulse_response(path, sample_rate):
+    """(channels, length) impulse response of the WAV file at ``path`` at
+    ``sample_rate``, normalized to unit energy per channel."""
+    wav = WavFile(path)
+    ir = wav.to_float(wav.data[:]).T
+    if wav.sample_rate != sample_rate:
+        ir = scipy.signal.resample_poly(ir, sample_rate, wav.sample_rate,
+                                        axis=1)
+    energy = np.sqrt((ir**2).sum(axis=1, keepdims=True))
+    return ir / np.where(energy > 0, energy, 1)
+
+
+class ConvolutionReverb:
+    """Convolution with an impulse response, uniformly partitioned.
+
+    The impulse response is cut into partitions of ``block_size`` samples
+    whose spectra are computed once. Every ``block_size`` input samples
+    take one FFT; the spectrum goes into a frequency-domain delay line,
+    which is multiplied with the partition spectra and summed. One inverse
+    FFT then gives the output by overlap-save. The cost per block is the
+    same at any point of the impulse response, and grows only by one
+    complex multiply-add per bin and partition.
+
+    Input is buffered to whole partitions, so the wet signal comes
+    ``block_size`` samples late. Blocks of any length can be passed.
+    ``ir`` is (length,) or (channels, length). A mono response is used for
+    every input channel and a multichannel one is mixed down for mono
+    input.
+    """
+
+    def __init__(self, ir, block_size=256, wet=0.3, dry=1.0):
+        ir = np.atleast_2d(ir)
+        self.block_size = block_size
+        self.wet = wet
+        self.dry = dry
+        B = block_size
+        n_parts = -(-ir.shape[1] // B)
+        parts = np.zeros((len(ir), n_parts * B))
+        parts[:, :ir.shape[1]] = ir
+        # (channels, partitions, bins), each partition zero-padded to 2B
+        self.spectra = np.fft.rfft(parts.reshape(len(ir), n_parts, B),
+                                   2 * B,
+                                   axis=2)
+        self.n_parts = n_parts
+        self._channels = None
+
+    def _reset(self, channels):
+        B = self.block_size
+        self._channels = channels
+        if len(self.spectra) == channels:
+            self._spectra = self.spectra
+        elif len(self.spectra) == 1:
+            self._spectra = np.broadcast_to(
+                self.spectra, (channels, ) + self.spectra.shape[1:])
+        else:
+            assert channels == 1, \
+                f'{len(self.spectra)} channel response, {channels} channels'
+            self._spectra = self.spectra.mean(axis=0, keepdims=True)
+        # the delay line is stored twice, so the newest n_parts spectra are
+        # always one contiguous slice starting at _head
+        self._fdl = np.zeros((channels, 2 * self.n_parts, B + 1), complex)
+        self._head = 0
+        self._window = np.zeros((channels, 2 * B))
+        self._in = np.zeros((channels, 0))
+        self._out = np.zeros((channels, B))
+        self._silent = self.n_parts + 1
+
+    @property
+    def idle(self):
+        return self._channels is None or (self._silent > self.n_parts and
+                                          not self._in.any() and
+                                          not self._out.any())
+
+    def _partition(self, block):
+        """Wet output of one partition of input."""
+        B = self.block_size
+        self._window[:, :B] = self._window[:, B:]
+        self._window[:, B:] = block
+        self._silent = self._silent + 1 if not block.any() else 0
+        if self._silent > self.n_parts:
+            return np.zeros_like(block)
+        self._head = (self._head - 1) % self.n_parts
+        spectrum = np.fft.rfft(self._window, axis=1)
+        self._fdl[:, self._head] = spectrum
+        self._fdl[:, self._head + self.n_parts] = spectrum
+        newest = self._fdl[:, self._head:self._head + self.n_parts]
+        acc = np.einsum('cpk,cpk->ck', newest, self._spectra)
+        return np.fft.irfft(acc, 2 * B, axis=1)[:, B:]
+
+    def __call__(self, buf):
+        mono = buf.ndim == 1
+        x = np.atleast_2d(buf)
+        if self._channels != len(x):
+            self._reset(len(x))
+        if self.idle and not x.any():
+            return buf * self.dry
+
+        B = self.block_size
+        pending = np.concatenate((self._in, x), axis=1)
+        n_full = pending.shape[1] // B
+        wet = [self._out]
+        for k in range(n_full):
+            wet.append(self._partition(pending[:, k * B:(k + 1) * B]))
+        self._in = pending[:, n_full * B:]
+        wet = np.concatenate(wet, axis=1)
+        n = x.shape[1]
+        self._out = wet[:, n:]
+        out = self.dry * x + self.wet * wet[:, :n]
+        return out[0] if mono else out
+
+
+class DelayLine:
+    """Circular buffer holding the last ``size`` samples of each channel.
+
+    ``read`` looks ``delays`` samples back from each sample of the next
+    block; fractional delays are linearly interpolated. A block can be read
+    before it is written as long as every delay is longer than the block,
+    which is how the feedback effects below process a whole block (or a
+    chunk of it no longer than their shortest delay) at once.
+    """
+
+    def __init__(self, size, channels=1):
+        self.size = size
+        self.channels = channels
+        self.buf = np.zeros((channels, size))
+        self.pos = 0
+
+    def clear(self):
+        self.buf[:] = 0
+
+    def read(self, delays, n):
+        t = self.pos + np.arange(n) - np.asarray(delays, dtype=float)
+        t = np.broadcast_to(t, (self.channels, n))
+        i = np.floor(t).astype(int)
+        frac = t - i
+        a = np.take_along_axis(self.buf, i % self.size, axis=1)
+        if not frac.any():
+            return a
+        b = np.take_along_axis(self.buf, (i + 1) % self.size, axis=1)
+        return a + frac * (b - a)
+
+    def write(self, block):
+        n = block.shape[-1]
+        self.buf[:, (self.pos + np.arange(n)) % self.size] = block
+        self.pos = (self.pos + n) % self.size
+
+
+def _chunks(n, size):
+    for start in range(0, n, size):
+        yield slice(start, min(start + size, n))
+
+
+class FDNReverb:
+    """Feedback delay network reverb.
+
+    Eight delay lines of mutually prime lengths feed back into each other
+    through an orthogonal Hadamard matrix. Each line has a one-pole low
+    pass for high frequency damping and a gain that makes the tail fall by
+    60 dB in ``t60`` seconds. Blocks are processed in chunks no longer than
+    the shortest line, so a whole chunk is read before it is written.
+    Mono input gives a mono sum of the lines, stereo input two decorrelated
+    sums.
+    """
+
+    DELAYS_MS = (29.7, 37.1, 41.1, 43.7, 53.9, 59.3, 67.1, 73.3)
+
+    def __init__(self, sample_rate, t60=2.0, damping=0.3, size=1.0,
+                 wet=0.25, dry=1.0):
+        self.wet = wet
+        self.dry = dry
+        lines = len(self.DELAYS_MS)
+        self.delays = np.array(
+            [int(ms * size * sample_rate / 1000) for ms in self.DELAYS_MS])
+        self.gains = 10**(-3 * self.delays / (t60 * sample_rate))
+        self.damping = damping
+        self.matrix = scipy.linalg.hadamard(lines) / np.sqrt(lines)
+        signs = np.where(np.arange(lines) % 2, -1., 1.)
+        self.inputs = signs[:, None]
+        # output taps, a second sign pattern for the right channel
+        self.taps = np.stack((signs, np.roll(signs, 1))) / np.sqrt(lines)
+        self.lines = DelayLine(self.delays.max() + 1, channels=lines)
+        self._zi = np.zeros((lines, 1))
+        self._idle = True
+
+    @property
+    def idle(self):
+        return self._idle
+
+    def __call__(self, buf):
+        mono = buf.ndim == 1
+        x = np.atleast_2d(buf)
+        if self._idle and not x.any():
+            return buf * self.dry
+
+        n = x.shape[1]
+        inp = x.mean(axis=0)
+        lines = np.empty((len(self.delays), n))
+        for chunk in _chunks(n, int(self.delays.min())):
+            m = chunk.stop - chunk.start
+            out = self.lines.read(self.delays[:, None], m)
+            lines[:, chunk] = out
+            damped, self._zi = scipy.signal.lfilter([1 - self.damping],
+                                                    [1, -self.damping],
+                                                    out * self.gains[:, None],
+                                                    axis=1,
+                                                    zi=self._zi)
+            self.lines.write(self.matrix @ damped + self.inputs * inp[chunk])
+
+        wet = self.taps[:len(x)] @ lines
+        if not x.any() and np.abs(self.lines.buf).max() < 1e-5:
+            # the tail has died away: drop what is left of it
+            self._idle = True
+            self.lines.clear()
+            self._zi[:] = 0
+        else:
+            self._idle = False
+        out = self.dry * x + self.wet * wet
+        return out[0] if mono else out
+
+
+class TempoDelay:
+    """Feedback delay of ``beats`` at ``bpm``, e.g. 0.75 for a dotted
+    eighth note."""
+
+    def __init__(self, sample_rate, bpm=120, beats=0.75, feedback=0.4,
+                 wet=0.3, dry=1.0, max_seconds=4.0):
+        self.sample_rate = sample_rate
+        self.feedback = feedback
+        self.wet = wet
+        self.dry = dry
+        self.max_seconds = max_seconds
+        self.line = None
+        self._silent = 0
+        self.set_tempo(bpm, beats)
+
+    def set_tempo(self, bpm, beats=None):
+        if beats is not None:
+            self.beats = beats
+        seconds = min(60 / bpm * self.beats, self.max_seconds)
+        self.delay = max(int(round(seconds * self.sample_rate)), 1)
+
+    @property
+    def idle(self):
+        # silent for as long as the echoes take to fall below -100 dB
+        repeats = 5 / max(-np.log10(max(self.feedback, 1e-5)), 1e-3)
+        return self.line is None or self._silent > self.delay * (repeats + 1)
+
+    def __call__(self, buf):
+        mono = buf.ndim == 1
+        x = np.atleast_2d(buf)
+        if self.line is None or self.line.channels != len(x):
+            size = int(self.max_seconds * self.sample_rate) + 1
+            self.line = DelayLine(size, channels=len(x))
+            self._silent = self.delay * 1000
+        n = x.shape[1]
+        self._silent = self._silent + n if not x.any() else 0
+        if self.idle:
+            return buf * self.dry
+
+        wet = np.empty_like(x)
+        for chunk in _chunks(n, self.delay):
+            m = chunk.stop - chunk.start
+            echo = self.line.read(self.delay, m)
+            wet[:, chunk] = echo
+            self.line.write(x[:, chunk] + self.feedback * echo)
+        out = self.dry * x + self.wet * wet
+        return out[0] if mono else out
+
+
+class Chorus:
+    """Chorus, or flanger with a short ``delay``: the input mixed with a
+    copy whose delay is swept by a sine LFO, ``depth`` seconds either way.
+
+    The delays of a block are computed as an array and read with linear
+    interpolation. Stereo channels get LFOs a quarter cycle apart. There is
+    no feedback, which a flanger's delays, shorter than a block, would
+    need sample by sample.
+    """
+
+    def __init__(self, sample_rate, rate=0.8, depth=0.002, delay=0.012,
+                 mix=0.5):
+        assert depth < delay, 'the delay must stay above 0'
+        self.sample_rate = sample_rate
+        self.rate = rate
+        self.depth = depth
+        self.delay = delay
+        self.mix = mix
+        self.line = None
+        self._phase = 0.
+        self._silent = 0
+
+    @property
+    def idle(self):
+        max_delay = (self.delay + self.depth) * self.sample_rate
+        return self.line is None or self._silent > max_delay
+
+    def __call__(self, buf):
+        mono = buf.ndim == 1
+        x = np.atleast_2d(buf)
+        n = x.shape[1]
+        needed = int((self.delay + self.depth) * self.sample_rate) + n + 2
+        if self.line is None or self.line.channels != len(x) or \
+                self.line.size < needed:
+            self.line = DelayLine(max(needed, 8192), channels=len(x))
+            self._silent = needed
+        self._silent = self._silent + n if not x.any() else 0
+        if self.idle:
+            return buf * (1 - self.mix)
+
+        step = 2 * np.pi * self.rate / self.sample_rate
+        phase = self._phase + step * np.arange(n) + \
+            np.arange(len(x))[:, None] * np.pi / 2
+        self._phase = (self._phase + step * n) % (2 * np.pi)
+        delays = (self.delay + self.depth * np.sin(phase)) * self.sample_rate
+
+        self.line.write(x)
+        # the block is already written: look back past it
+        wet = self.line.read(delays + n, n)
+        out = (1 - self.mix) * x + self.mix * wet
+        return out[0] if mono else out
@@ -0,0 +1,676 @@
+"""Synth engine shared by the Qt app and the offline renderer.
+Synth.build_osc builds the voice the app has always played; it lives here
+so that it can run without Qt or an audio device.
+"""
+import functools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from additive import AdditiveOscillator
+from dynamics import Compressor, Limiter
+from effects import (Chorus, ConvolutionReverb, FDNReverb, TempoDelay,
+                     load_impulse_response)
+from envelope import Envelope
+from fm import FMOscillator
+from modmatrix import (Controls, Glide, MatrixVoice, ModMatrix,
+                       classic_lfo_routes)
+from oscillators import (NOISE_TYPES, Decimator, LowpassFilter,
+                         SharedModulator, UnisonOscillator, butter_sos,
+                         get_osc_by_type)
+from params import SmoothedParam
+from sampler import SamplerOscillator, load_sample_library
+from wavetable import load_wavetable
+
+LPF_ORDER = 5
+FADE_DURATION = 0.005  # crossfade of retriggered and stolen voices
+SMOOTHED_PARAMS = ('cutoff', 'lpf_intensity')
+PAN_STEPS = 256
+# equal power pan law: (left, right) gains from hard left to hard right
+PAN_TABLE = np.stack((np.cos(np.linspace(0, np.pi / 2, PAN_STEPS + 1)),
+                      np.sin(np.linspace(0, np.pi / 2, PAN_STEPS + 1))))
+
+
+@functools.lru_cache(maxsize=8)
+def fade_out_table(sample_rate, duration=FADE_DURATION):
+    """Shared read-only fade out gains."""
+    length = max(int(duration * sample_rate), 1)
+    table = np.cos(np.linspace(0, np.pi / 2, length, endpoint=False))**2
+    table.flags.writeable = False
+    return table
+
+
+def pan_gains(pan):
+    """(2, 1) or (2, n) gains of a scalar or per-sample ``pan``, -1 left
+    to 1 right, looked up in PAN_TABLE."""
+    steps = np.rint((np.clip(pan, -1, 1) + 1) * (PAN_STEPS / 2))
+    return PAN_TABLE[:, steps.astype(int)].reshape(2, -1)
+
+
+def place(block, channels, pan=0.):
+    """A voice's (n,) or (2, n) ``block`` on ``channels`` outputs.
+
+    Mono blocks are panned with pan_gains. Stereo blocks, e.g. a spread
+    unison, are balanced with the same gains scaled to 1 at the centre.
+    """
+    if channels == 1:
+        return block if block.ndim == 1 else block.mean(axis=0)
+    gains = pan_gains(pan)
+    if block.ndim == 1:
+        return gains * block
+    return block * (gains * math.sqrt(2))
+
+
+class Patch:
+
+    def __init__(self,
+                 wave_type='sine',
+                 unison=1,
+                 unison_detune=20.,
+                 unison_spread=1.,
+                 pan=0.,
+                 pan_spread=0.,
+                 bend_range=2.,
+                 glide=0.,
+                 glide_curve='exponential',
+                 glide_legato=False,
+                 partials=64,
+                 fm_algorithm=5,
+                 fm_operators=None,
+                 sample_library=None,
+                 wavetable=None,
+                 wavetable_position=0.,
+                 lfo_wave_type='sine',
+                 lfo_freq=0,
+                 lfo_global=False,
+                 mod_routes=None,
+                 attack_duration=0.2,
+                 decay_duration=0.4,
+                 sustain_level=0.4,
+                 release_duration=0.5,
+                 cutoff=0,
+                 lpf_intensity=1.0,
+                 chorus=0.,
+                 chorus_rate=0.8,
+                 tempo=120,
+                 delay_beats=0,
+                 delay_feedback=0.4,
+                 delay_wet=0.3,
+                 fdn_reverb=0.,
+                 fdn_t60=2.0,
+                 reverb_ir=None,
+                 reverb_wet=0.3,
+                 compressor=False,
+                 compressor_threshold=-18.,
+                 compressor_ratio=4.,
+                 limiter=False,
+                 limiter_ceiling=-1.):
+        self.wave_type = wave_type
+        # detuned copies of the main oscillator, detune in cents
+        self.unison = unison
+        self.unison_detune = unison_detune
+        self.unison_spread = unison_spread
+        # stereo position, -1 left to 1 right, and how far notes are spread
+        # around it by key: 1 puts the lowest key left and the highest right
+        self.pan = pan
+        self.pan_spread = pan_spread
+        # semitones of a full pitch bend either way
+        self.bend_range = bend_range
+        # portamento: seconds a new note takes to slide from the last one,
+        # 'exponential' (even in pitch) or 'linear' (even in Hz), and with
+        # glide_legato only while another note is held
+        self.glide = glide
+        self.glide_curve = glide_curve
+        self.glide_legato = glide_legato
+        # harmonics of the 'additive' wave type
+        self.partials = partials
+        # algorithm number and operator settings of the 'fm' wave type,
+        # see fm.py; None operators for the default preset
+        self.fm_algorithm = fm_algorithm
+        self.fm_operators = fm_operators
+        # JSON keyzone mapping of the 'sampler' wave type, see sampler.py
+        self.sample_library = sample_library
+        # WAV file and frame morph (0-1) of the 'wavetable' wave type
+        self.wavetable = wavetable
+        self.wavetable_position = wavetable_position
+        self.lfo_wave_type = lfo_wave_type
+        self.lfo_freq = lfo_freq
+        # one free running LFO shared by all voices instead of one per note
+        self.lfo_global = lfo_global
+        # (source, destination, depth) routes of the modulation matrix,
+        # None for the classic LFO to amp and pitch routing
+        self.mod_routes = mod_routes
+        self.attack_duration = attack_duration
+        self.decay_duration = decay_duration
+        self.sustain_level = sustain_level
+        self.release_duration = release_duration
+        self.cutoff = cutoff
+        self.lpf_intensity = lpf_intensity
+        # effects, in the order they are applied; a mix, wet level or
+        # length of 0 turns an effect off
+        self.chorus = chorus
+        self.chorus_rate = chorus_rate
+        self.tempo = tempo
+        self.delay_beats = delay_beats
+        self.delay_feedback = delay_feedback
+        self.delay_wet = delay_wet
+        self.fdn_reverb = fdn_reverb
+        self.fdn_t60 = fdn_t60
+        # impulse response WAV of the convolution reverb, None for no reverb
+        self.reverb_ir = reverb_ir
+        self.reverb_wet = reverb_wet
+        # master dynamics after the effects (see dynamics.py), levels in dB
+        self.compressor = compressor
+        self.compressor_threshold = compressor_threshold
+        self.compressor_ratio = compressor_ratio
+        self.limiter = limiter
+        self.limiter_ceiling = limiter_ceiling
+
+
+def main_oscillator(patch, freq, sample_rate, seed=None, stereo=False):
+    """The oscillator a voice of ``patch`` plays at ``freq``; ``seed``
+    seeds noise. With ``stereo`` a unison is spread over two channels."""
+    if patch.wave_type == 'additive':
+        return AdditiveOscillator(freq,
+                                  n_partials=patch.partials,
+                                  sample_rate=sample_rate)
+    if patch.wave_type == 'sampler':
+        return SamplerOscillator(freq,
+                                 library=load_sample_library(
+                                     patch.sample_library),
+                                 sample_rate=sample_rate)
+    if patch.wave_type == 'wavetable':
+        osc = get_osc_by_type('wavetable',
+                              freq=freq,
+                              sample_rate=sample_rate,
+                              wavetable=load_wavetable(patch.wavetable))
+        osc.position = patch.wavetable_position
+        return osc
+    if patch.wave_type == 'fm':
+        return FMOscillator(freq,
+                            operators=patch.fm_operators,
+                            algorithm=patch.fm_algorithm,
+                            sample_rate=sample_rate)
+    if patch.unison > 1 and patch.wave_type not in NOISE_TYPES:
+        return UnisonOscillator(patch.wave_type,
+                                freq=freq,
+                                sample_rate=sample_rate,
+                                voices=patch.unison,
+                                detune=patch.unison_detune,
+                                spread=patch.unison_spread,
+                                stereo=stereo)
+    return get_osc_by_type(patch.wave_type,
+                           freq=freq,
+                           sample_rate=sample_rate,
+                           seed=seed)
+
+
+def build_effects(patch, sample_rate, block_size):
+    """The effect chain of ``patch``."""
+    effects = []
+    if patch.chorus > 0:
+        effects.append(
+            Chorus(sample_rate, rate=patch.chorus_rate, mix=patch.chorus))
+    if patch.delay_beats > 0:
+        effects.append(
+            TempoDelay(sample_rate,
+                       bpm=patch.tempo,
+                       beats=patch.delay_beats,
+                       feedback=patch.delay_feedback,
+                       wet=patch.delay_wet))
+    if patch.fdn_reverb > 0:
+        effects.append(
+            FDNReverb(sample_rate, t60=patch.fdn_t60, wet=patch.fdn_reverb))
+    if patch.reverb_ir is not None:
+        ir = load_impulse_response(patch.reverb_ir, sample_rate)
+        effects.append(
+            ConvolutionReverb(ir,
+                              block_size=block_size,
+                              wet=patch.reverb_wet))
+    if patch.compressor:
+        effects.append(
+            Compressor(sample_rate,
+                       threshold=patch.compressor_threshold,
+                       ratio=patch.compressor_ratio))
+    if patch.limiter:
+        effects.append(Limiter(sample_rate, ceiling=patch.limiter_ceiling))
+    return effects
+
+
+class ModulationSources:
+    """Registry of global modulation sources, rendered once per block.
+
+    Voices asking for the same source share one SharedModulator, so the
+    cost of an LFO does not grow with the number of voices playing it.
+    """
+
+    def __init__(self, sample_rate, seeds=None):
+        self.sample_rate = sample_rate
+        self.seeds = seeds if seeds is not None else np.random.SeedSequence()
+        self.sources = {}
+
+    def lfo(self, wave_type, freq):
+        key = ('lfo', wave_type, freq)
+        if key not in self.sources:
+            self.sources[key] = SharedModulator(
+                get_osc_by_type(wave_type,
+                                freq=freq,
+                                sample_rate=self.sample_rate,
+                                wave_range=(0.2, 1.0),
+                                seed=self.seeds.spawn(1)[0]))
+        return self.sources[key]
+
+    def advance(self, n, in_use):
+        """Render the next block of every source that is still in use."""
+        for key, source in list(self.sources.items()):
+            if source in in_use:
+                source.advance(n)
+            else:
+                del self.sources[key]
+
+
+class Voice:
+    """One slot of the synth's voice pool."""
+
+    def __init__(self):
+        self.note = None
+        self.osc = None
+        self.sources = ()
+        self.pan = 0.
+        self.released = False
+
+    def start(self, note, osc, sources=(), pan=0.):
+        self.note = note
+        self.osc = osc
+        self.sources = sources
+        self.pan = pan
+        self.released = False
+
+    def free(self):
+        self.note = None
+        self.osc = None
+        self.sources = ()
+
+    def release(self):
+        self.released = True
+        self.osc.trigger_note_release()
+
+    @property
+    def ended(self):
+        return self.osc.ended
+
+    @property
+    def silent(self):
+        return getattr(self.osc, 'silent', False)
+
+    def render(self, n, channels=1):
+        return render_placed(self.osc, n, channels, self.pan)
+
+
+def render_placed(osc, n, channels, pan):
+    """Render ``osc`` and place it at ``pan``, plus its modulated pan."""
+    block = osc.render(n)
+    if channels > 1 and getattr(osc, 'pan', None) is not None:
+        pan = pan + osc.pan
+    return place(block, channels, pan)
+
+
+class FadeOut:
+    """Tail of a voice that was cut off, faded out over a few ms."""
+
+    def __init__(self, osc, sources=(), pan=0.):
+        self.osc = osc
+        self.sources = sources
+        self.pan = pan
+        self.pos = 0
+
+    def mix_into(self, buf, table):
+        n = min(buf.shape[-1], len(table) - self.pos)
+        channels = len(buf) if buf.ndim == 2 else 1
+        buf[..., :n] += render_placed(self.osc, n, channels, self.pan) * \
+            table[self.pos:self.pos + n]
+        self.pos += n
+        return self.pos < len(table)
+
+
+class Synth:
+    """Polyphonic synth: up to ``max_voices`` voices mixed into one block.
+
+    With ``threads`` > 1 the active voices are split into that many groups
+    which are rendered concurrently on a persistent thread pool and summed.
+    This pays off when the voices' NumPy kernels, which release the GIL,
+    dominate the block time, i.e. with many voices or large blocks.
+
+    Voices whose envelope has ended go back to the pool at the start of the
+    next block. A held voice whose envelope has gone silent, e.g. one that
+    decayed to a sustain level of 0, is not rendered until it is released;
+    ``skipped_voice_blocks`` counts those skipped renders.
+
+    A retriggered or stolen voice is not cut off mid-cycle. Its old sound
+    keeps playing for FADE_DURATION under a precomputed fade out table,
+    mixed into the same blocks as the new note.
+
+    Filter parameters changed with set_param() are ramped inside the block
+    from the sample matching the time of the change (see params.py), and
+    the filter keeps its state between blocks.
+
+    ``effects`` (see effects.py) process the filtered mix in order, the
+    compressor and limiter of dynamics.py last.
+    ``block_size`` is the partition size of the convolution reverb and
+    should be the audio buffer size.
+
+    With ``oversample`` > 1 the voices run at that multiple of
+    ``sample_rate``, so naive waveforms alias less, and their mix is
+    decimated back before the filter (see Decimator).
+
+    With 2 ``channels`` blocks are (2, n): every voice is panned by the
+    patch pan, its key and its pan modulation (see place()), and the
+    filter and effects run on both channels.
+    """
+
+    def __init__(self, patch=None, sample_rate=22_050, max_voices=8,
+                 threads=1, seed=0, block_size=256, oversample=1,
+                 channels=1):
+        assert channels in (1, 2), f'{channels} channels, 1 or 2 supported'
+        self.patch = patch if patch is not None else Patch()
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.oversample = oversample
+        self.voice_rate = sample_rate * oversample
+        self.decimator = Decimator(oversample) if oversample > 1 else None
+        self.max_voices = max_voices
+        self.pool = [Voice() for _ in range(max_voices)]
+        self.voices = []
+        self.skipped_voice_blocks = 0
+        self.fade_table = fade_out_table(self.voice_rate)
+        self.fades = []
+        # every noise source gets its own stream spawned from one seed, in
+        # the order notes are played, so renders are reproducible
+        self.seeds = np.random.SeedSequence(seed)
+        self.mod_sources = ModulationSources(self.voice_rate, self.seeds)
+        self.controls = Controls()
+        self.last_freq = None
+        self.lpf = LowpassFilter(sample_rate, order=LPF_ORDER)
+        self.params = {
+            name: SmoothedParam(getattr(self.patch, name), sample_rate)
+            for name in SMOOTHED_PARAMS
+        }
+        self.block_size = block_size
+        self.effects = build_effects(self.patch, sample_rate, block_size)
+        self._render_time = time.perf_counter()
+        self.threads = threads
+        self.executor = None
+        if threads > 1:
+            # the calling thread renders one group itself
+            self.executor = ThreadPoolExecutor(max_workers=threads - 1)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    @property
+    def active(self):
+        return bool(self.voices or self.fades) or not self.effects_idle
+
+    @property
+    def effects_idle(self):
+        """No tail is left in the decimator or the effects."""
+        return (self.decimator is None or self.decimator.idle) and all(
+            effect.idle for effect in self.effects)
+
+    @property
+    def latency(self):
+        """Samples the decimator and effects delay the output by."""
+        latency = sum(getattr(e, 'latency', 0) for e in self.effects)
+        if self.decimator is not None:
+            latency += self.decimator.latency
+        return latency
+
+    @property
+    def dynamics_metrics(self):
+        """Latency and gain reduction of the compressor and limiter."""
+        return {
+            type(effect).__name__.lower(): effect.metrics
+            for effect in self.effects if hasattr(effect, 'metrics')
+        }
+
+    def set_param(self, name, value, timestamp=None):
+        setattr(self.patch, name, value)
+        if name in self.params:
+            self._queue_param(name, value, timestamp)
+
+    def _queue_param(self, name, value, timestamp=None):
+        param = self.params[name]
+        if name == 'cutoff' and (value <= 0 or param.target <= 0):
+            # switching the filter on or off is not swept through 0 Hz
+            param.jump(value)
+        else:
+            param.set(value, timestamp)
+
+    @property
+    def ended(self):
+        return not self.fades and all(
+            voice.ended for voice in self.voices) and self.effects_idle
+
+    def build_osc(self, freq, velocity=1., glide=None):
+        """Return the voice's oscillator chain and the global sources it
+        reads from."""
+        patch = self.patch
+        sample_rate = self.voice_rate
+        sources = ()
+        lfo = None
+        if patch.lfo_freq != 0:
+            if patch.lfo_global:
+                lfo = self.mod_sources.lfo(patch.lfo_wave_type,
+                                           patch.lfo_freq)
+                sources = (lfo, )
+            else:
+                lfo = get_osc_by_type(patch.lfo_wave_type,
+                                      freq=patch.lfo_freq,
+                                      sample_rate=sample_rate,
+                                      wave_range=(0.2, 1.0),
+                                      seed=self.seeds.spawn(1)[0])
+
+        routes = patch.mod_routes
+        if routes is None:
+            routes = classic_lfo_routes() if lfo is not None else ()
+        assert patch.lfo_global or ('lfo', 'cutoff') not in [
+            route[:2] for route in routes
+        ], 'Only a global LFO can drive the shared filter cutoff'
+        osc = iter(
+            MatrixVoice(
+                main_oscillator(patch, freq, sample_rate,
+                                self.seeds.spawn(1)[0],
+                                stereo=self.channels == 2),
+                Envelope(
+                    attack_duration=patch.attack_duration,
+                    decay_duration=patch.decay_duration,
+                    sustain_level=patch.sustain_level,
+                    release_duration=patch.release_duration,
+                    sample_rate=sample_rate,
+                ),
+                ModMatrix(routes),
+                lfo=lfo,
+                velocity=velocity,
+                controls=self.controls,
+                glide=glide,
+            ))
+        return osc, sources
+
+    def control_change(self, controller, value):
+        if controller == 1:
+            self.controls.mod_wheel = value / 127
+
+    def pitch_bend(self, value):
+        """14-bit MIDI pitch bend, 8192 for none."""
+        self.controls.bend = (value - 8192) / 8192 * self.patch.bend_range
+
+    def _glide(self, freq):
+        patch = self.patch
+        start, self.last_freq = self.last_freq, freq
+        if patch.glide <= 0 or start is None or start == freq:
+            return None
+        if patch.glide_legato and all(v.released for v in self.voices):
+            return None
+        return Glide(start / freq, patch.glide * self.voice_rate,
+                     patch.glide_curve)
+
+    def note_on(self, freq, note=None, velocity=127):
+        # a retriggered note replaces its voice
+        if note is not None:
+            for voice in self.voices:
+                if voice.note == note:
+                    self._fade_out(voice)
+            self.voices = [v for v in self.voices if v.osc is not None]
+        glide = self._glide(freq)
+        voice = self._free_voice()
+        voice.start(note,
+                    *self.build_osc(freq, velocity / 127, glide),
+                    pan=self.note_pan(note))
+        self.voices.append(voice)
+
+    def note_pan(self, note):
+        pan = self.patch.pan
+        if note is not None and self.patch.pan_spread:
+            pan += self.patch.pan_spread * (note - 63.5) / 63.5
+        return pan
+
+    def _free_voice(self):
+        for voice in self.pool:
+            if voice.osc is None:
+                return voice
+        # all voices are in use: steal the oldest
+        return self.steal_voice()
+
+    def steal_voice(self):
+        """Fade out the oldest voice and return its free slot."""
+        voice = self.voices.pop(0)
+        self._fade_out(voice)
+        return voice
+
+    def _fade_out(self, voice):
+        if not voice.ended:
+            self.fades.append(FadeOut(voice.osc, voice.sources, voice.pan))
+        voice.free()
+
+    def _cull_voices(self):
+        if any(voice.ended for voice in self.voices):
+            for voice in self.voices:
+                if voice.ended:
+                    voice.free()
+            self.voices = [v for v in self.voices if v.osc is not None]
+
+    def note_off(self, note=None):
+        for voice in self.voices:
+            if not voice.released and (note is None or voice.note == note):
+                voice.release()
+
+    def render(self, n):
+        """Render the next ``n`` samples as floats in [-1, 1]."""
+        now = time.perf_counter()
+        window = (self._render_time, now)
+        self._render_time = now
+
+        buf = self._mix(n)
+        if buf.any() or not self.lpf.idle:
+            buf = self._filter(buf, window)
+        for effect in self.effects:
+            buf = effect(buf)
+        return buf
+
+    def _mix(self, n):
+        if self.decimator is None:
+            return self._mix_voices(n)
+        return self.decimator(self._mix_voices(n * self.oversample))
+
+    def _mix_voices(self, n):
+        self._cull_voices()
+        if not self.voices and not self.fades:
+            return silence(n, self.channels)
+        in_use = set()
+        for voice in self.voices + self.fades:
+            in_use.update(voice.sources)
+        self.mod_sources.advance(n, in_use)
+        self.skipped_voice_blocks += sum(v.silent for v in self.voices)
+        if self.executor is None or len(self.voices) <= 1:
+            buf = mix_voices(self.voices, n, self.channels)
+        else:
+            groups = [
+                self.voices[i::self.threads] for i in range(self.threads)
+            ]
+            futures = [
+                self.executor.submit(mix_voices, group, n, self.channels)
+                for group in groups[1:] if group
+            ]
+            buf = mix_voices(groups[0], n, self.channels)
+            for future in futures:
+                buf += future.result()
+        if self.fades:
+            self.fades = [
+                fade for fade in self.fades
+                if fade.mix_into(buf, self.fade_table)
+            ]
+        return buf
+
+    def _filter(self, buf, window):
+        n = buf.shape[-1]
+        values = {}
+        for name, param in self.params.items():
+            if getattr(self.patch, name) != param.target:
+                # the patch was changed directly, not through set_param
+                self._queue_param(name, getattr(self.patch, name), window[0])
+            values[name] = param.render(n, window) if param.ramping \
+                else param.value
+        cutoff = values['cutoff']
+        routed = [v.osc for v in self.voices if v.osc.cutoff is not None]
+        if routed:
+            # one filter for all voices, driven by sources they share, so
+            # any rendered voice's route will do; taken down to the output
+            # rate
+            route = routed[-1].cutoff[::self.oversample]
+            cutoff = np.where(
+                cutoff > 0,
+                np.clip(cutoff + route, 1, 0.49 * self.sample_rate), 0)
+        return self.lpf(buf, cutoff, values['lpf_intensity'])
+
+
+def silence(n, channels=1):
+    return np.zeros(n) if channels == 1 else np.zeros((channels, n))
+
+
+def mix_voices(voices, n, channels=1):
+    buf = silence(n, channels)
+    for voice in voices:
+        if voice.silent:
+            voice.osc.skip()
+        else:
+            buf += voice.render(n, channels)
+    return buf
+
+
+def warm_caches(patches, sample_rate):
+    """Precompute the tables the given patches will ask for.
+
+    Meant for worker processes, so the first block of every render does
+    not pay for building them.
+    """
+    for patch in patches:
+        if patch.sample_library is not None:
+            load_sample_library(patch.sample_library)
+        if patch.wavetable is not None:
+            load_wavetable(patch.wavetable)
+        if patch.cutoff > 0:
+            butter_sos(LPF_ORDER, patch.cutoff, sample_rate)
+
+
+def to_int16(buf, channels=1):
+    """Interleaved int16 frames of a (n,) or (channels, n) ``buf``; a mono
+    block is copied to every channel."""
+    if buf.ndim == 2:
+        buf = buf.T.ravel()
+    elif channels > 1:
+        buf = np.repeat(buf, channels)
+    return (np.clip(buf, -1, 1) * 32767).astype(np.int16)
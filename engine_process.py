@@ -0,0 +1,272 @@
+"""Run the synth engine in its own process.
+
+The GUI process keeps only a mirror of the patch. Parameter changes and
+MIDI messages go to the engine process over a SimpleQueue. The engine
+renders blocks into an audio ring in shared memory and plays them from
+there. The block that was played last is published as a visualization
+frame, also in shared memory. pyqtgraph drawing in the GUI process can
+then no longer hold the GIL when the next block is due.
+
+The engine is multitimbral: every message carries its MIDI channel.
+
+With a max_block_size in the config, a BlockSizeController picks the
+size of each block and how many of them the ring may hold.
+"""
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import EngineConfig
+from engine import Patch, to_int16
+from multitimbral import Multitimbral
+
+_HEADER = 2  # int64 counters in front of the float32 data
+
+
+class SharedRing:
+    """Single-producer, single-consumer ring of float32 blocks of up to
+    ``block_size`` samples, (n,) or (channels, n).
+
+    The header holds the number of blocks written and read so far; each
+    side only advances its own counter, after the data is in place. The
+    length of every slot's block is kept after the header.
+    """
+
+    def __init__(self, slots, block_size, channels=1, name=None):
+        lengths = (_HEADER + slots) * 8
+        size = lengths + slots * channels * block_size * 4
+        self.shm = shared_memory.SharedMemory(name=name,
+                                              create=name is None,
+                                              size=size)
+        self.slots = slots
+        self.block_size = block_size
+        self.channels = channels
+        self.counters = np.ndarray((_HEADER, ), np.int64, self.shm.buf)
+        self.lengths = np.ndarray((slots, ), np.int64, self.shm.buf,
+                                  _HEADER * 8)
+        self.data = np.ndarray((slots, channels, block_size), np.float32,
+                               self.shm.buf, lengths)
+        if name is None:
+            self.counters[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __len__(self):
+        return int(self.counters[0] - self.counters[1])
+
+    def write(self, block):
+        written = self.counters[0]
+        if written - self.counters[1] >= self.slots:
+            return False
+        slot = written % self.slots
+        n = block.shape[-1]
+        self.data[slot, :, :n] = block
+        self.lengths[slot] = n
+        self.counters[0] = written + 1
+        return True
+
+    def read(self):
+        read = self.counters[1]
+        if read == self.counters[0]:
+            return None
+        slot = read % self.slots
+        block = self.data[slot, :, :self.lengths[slot]].copy()
+        self.counters[1] = read + 1
+        if self.channels == 1:
+            return block[0]
+        return block
+
+    def close(self, unlink=False):
+        del self.counters, self.lengths, self.data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedFrame:
+    """Latest visualization frame plus a sequence number and its length
+    in shared memory."""
+
+    def __init__(self, block_size, name=None):
+        self.shm = shared_memory.SharedMemory(name=name,
+                                              create=name is None,
+                                              size=16 + block_size * 4)
+        self.seq = np.ndarray((2, ), np.int64, self.shm.buf)
+        self.data = np.ndarray((block_size, ), np.float32, self.shm.buf, 16)
+        self.last_seq = 0
+        if name is None:
+            self.seq[0] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def publish(self, block):
+        self.data[:len(block)] = block
+        self.seq[1] = len(block)
+        self.seq[0] += 1
+
+    def latest(self):
+        """The newest frame, or None if it has not changed since last call."""
+        seq = int(self.seq[0])
+        if seq == self.last_seq:
+            return None
+        self.last_seq = seq
+        return self.data[:self.seq[1]].copy()
+
+    def close(self, unlink=False):
+        del self.seq, self.data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _play(ring, frame, stream, config, stop, lateness):
+    """Consume the ring at the audio rate.
+
+    With a PyAudio stream the blocking write paces the loop. Without one
+    (benchmarks, headless runs) blocks are taken on a wall clock schedule
+    and the delay of each block behind its deadline is recorded.
+    """
+    period = config.period
+    deadline = time.perf_counter() + period
+    while not stop.is_set():
+        if stream is None:
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        block = ring.read()
+        while block is None and not stop.is_set():
+            time.sleep(period / 8)
+            block = ring.read()
+        if block is None:
+            break
+        if stream is None:
+            lateness.append(max(time.perf_counter() - deadline, 0))
+            deadline += block.shape[-1] / config.sample_rate
+        else:
+            stream.write(to_int16(block, config.channels).tobytes())
+        # the plots show the mono mix
+        frame.publish(block if block.ndim == 1 else block.mean(axis=0))
+
+
+def _engine_main(messages, results, patch, patches, budgets, master, config,
+                 max_voices, ring_name, frame_name, slots, audio):
+    ring = SharedRing(slots, config.largest_block, config.channels,
+                      name=ring_name)
+    frame = SharedFrame(config.largest_block, name=frame_name)
+    controller = config.block_size_controller(max_depth=slots)
+    config.prepare([patch, *patches.values()] +
+                   ([master] if master is not None else []))
+    synth = Multitimbral(patch, patches, budgets, master,
+                         max_voices=max_voices, **config.synth_args())
+
+    stream = None
+    if audio:
+        import pyaudio
+        stream = pyaudio.PyAudio().open(rate=config.sample_rate,
+                                        channels=config.channels,
+                                        format=pyaudio.paInt16,
+                                        output=True,
+                                        frames_per_buffer=config.block_size)
+    stop = threading.Event()
+    lateness = []
+    player = threading.Thread(target=_play,
+                              args=(ring, frame, stream, config, stop,
+                                    lateness),
+                              daemon=True)
+    player.start()
+
+    block_size, depth = config.block_size, slots
+    running = True
+    while running:
+        while not messages.empty():
+            msg = messages.get()
+            if msg[0] == 'note_on':
+                synth.note_on(msg[1], note=msg[2], velocity=msg[3],
+                              channel=msg[4])
+            elif msg[0] == 'note_off':
+                synth.note_off(note=msg[1], channel=msg[2])
+            elif msg[0] == 'cc':
+                synth.control_change(msg[1], msg[2], channel=msg[3])
+            elif msg[0] == 'bend':
+                synth.pitch_bend(msg[1], channel=msg[2])
+            elif msg[0] == 'param':
+                synth.set_param(msg[1], msg[2], timestamp=msg[3],
+                                channel=msg[4])
+            elif msg[0] == 'stop':
+                running = False
+        if controller is not None:
+            block_size, depth = controller.block_size, controller.depth
+        if len(ring) < depth:
+            start = time.perf_counter()
+            ring.write(synth.render(block_size))
+            if controller is not None:
+                controller.update(time.perf_counter() - start, block_size)
+        else:
+            time.sleep(block_size / config.sample_rate / 4)
+
+    stop.set()
+    player.join()
+    synth.close()
+    results.put({'lateness': lateness})
+    ring.close()
+    frame.close()
+
+
+class EngineProcess:
+    """Same calls as Multitimbral, served by one in a child process.
+    ``patch`` is mirrored for channel 0."""
+
+    def __init__(self, patch=None, config=None, max_voices=8, slots=4,
+                 audio=True, patches=None, budgets=None, master=None):
+        self.patch = patch if patch is not None else Patch()
+        self.config = config if config is not None else EngineConfig()
+        self.ring = SharedRing(slots, self.config.largest_block,
+                               self.config.channels)
+        self.frame = SharedFrame(self.config.largest_block)
+        self.messages = mp.SimpleQueue()
+        self.results = mp.SimpleQueue()
+        self.process = mp.Process(target=_engine_main,
+                                  args=(self.messages, self.results,
+                                        self.patch, patches or {},
+                                        budgets or {}, master, self.config,
+                                        max_voices, self.ring.name,
+                                        self.frame.name, slots, audio),
+                                  daemon=True)
+        self.process.start()
+
+    def note_on(self, freq, note=None, velocity=127, channel=0):
+        self.messages.put(('note_on', freq, note, velocity, channel))
+
+    def note_off(self, note=None, channel=0):
+        self.messages.put(('note_off', note, channel))
+
+    def control_change(self, controller, value, channel=0):
+        self.messages.put(('cc', controller, value, channel))
+
+    def pitch_bend(self, value, channel=0):
+        self.messages.put(('bend', value, channel))
+
+    def set_param(self, name, value, channel=0):
+        if channel == 0:
+            setattr(self.patch, name, value)
+        self.messages.put(
+            ('param', name, value, time.perf_counter(), channel))
+
+    def latest_frame(self):
+        return self.frame.latest()
+
+    def close(self):
+        """Stop the engine process and return its playback statistics."""
+        self.messages.put(('stop', ))
+        stats = self.results.get()
+        self.process.join()
+        self.ring.close(unlink=True)
+        self.frame.close(unlink=True)
+        return stats
@@ -2,7 +2,9 @@
 The code is almost the same as the article below.
 https://python.plainenglish.io/build-your-own-python-synthesizer-part-2-66396f6dad81
 """
+import functools
 import itertools
+import math
 
 import numpy as np
 
@@ -27,24 +29,74 @@ class Envelope:
         self.sustain_level = sustain_level
         self.release_duration = release_duration
         self.sample_rate = sample_rate
+        self.ended = False
 
     def __iter__(self):
         self.val = 0
         self.ended = False
         self.stepper = self.ads_stepper()
+        self._stage = 'ads'
+        self._pos = 0
         return self
 
     def __next__(self):
         self.val = next(self.stepper)
         return self.val
 
+    @property
+    def silent(self):
+        """True when render() gives only zeros until the next note on or
+        release, e.g. a held note that decayed to a sustain level of 0."""
+        return self.ended or (self.val == 0 and self._pos > 1)
+
     def trigger_note_on(self):
         self.val = 0
         self.ended = False
         self.stepper = self.ads_stepper()
+        self._stage = 'ads'
+        self._pos = 0
 
     def trigger_note_release(self):
         self.stepper = self.r_stepper()
+        self._stage = 'r'
+        self._pos = 0
+        self._release_from = self.val
+
+    def render(self, n):
+        """Next ``n`` envelope values as an array.
+
+        Evaluates the same straight segments the steppers walk through, in
+        closed form from the sample position within the current stage.
+        """
+        k = self._pos + np.arange(n)
+        self._pos += n
+        if self._stage == 'ads':
+            attack_step = 1 / (self.attack_duration * self.sample_rate)
+            decay_step = (1 - self.sustain_level) / (self.decay_duration *
+                                                     self.sample_rate)
+            attack_len = math.floor(1 / attack_step) + 1
+            decay = np.maximum(1 - (k - attack_len) * decay_step,
+                               self.sustain_level)
+            val = np.where(k < attack_len, k * attack_step, decay)
+        else:
+            start = self._release_from
+            if self.release_duration > 0:
+                step = self.sustain_level / (self.release_duration *
+                                             self.sample_rate)
+            else:
+                start, step = -1, 0
+            # the first value at or below zero is still emitted, then zeros
+            if start <= 0:
+                last = -1 if self.release_duration == 0 else 0
+            elif step > 0:
+                last = math.ceil(start / step)
+            else:
+                last = math.inf
+            val = np.where(k <= last, start - k * step, 0.)
+            if k[-1] > last:
+                self.ended = True
+        self.val = val[-1]
+        return val
 
     def ads_stepper(self):
         attack_stepper = itertools.count(
@@ -103,3 +155,34 @@ class Envelope:
         ]
         adsr = np.array(adsr)
         return adsr
+
+
+@functools.lru_cache(maxsize=512)
+def adsr_shape(attack_duration,
+               decay_duration,
+               sustain_level,
+               release_duration,
+               sample_rate,
+               n_points,
+               note_on_duration=0.2):
+    """Same curve as Envelope.get_shape(), computed from the breakpoints.
+
+    The envelope is piecewise linear, so instead of stepping the generator
+    sample by sample the segment corners are interpolated at ``n_points``
+    positions (e.g. the pixel width of the plot). Results are memoized by
+    the parameter tuple and returned read-only.
+    """
+    attack = attack_duration * sample_rate
+    decay = decay_duration * sample_rate
+    release_start = int((attack_duration + decay_duration) * sample_rate) + \
+        int(note_on_duration * sample_rate)
+    release = release_duration * sample_rate
+    total = release_start + int(release)
+
+    bx = [0, attack, attack + decay, release_start, release_start + release]
+    by = [0, 1, sustain_level, sustain_level, 0]
+    x = np.linspace(0, max(total - 1, 0), max(n_points, 2))
+    y = np.interp(x, bx, by)
+    x.flags.writeable = False
+    y.flags.writeable = False
+    return x, y
@@ -0,0 +1,151 @@
+"""Multi-operator FM (phase modulation) voices.
+
+An FM voice has 4 or 6 sine operators, each with its own frequency ratio,
+output level and ADSR envelope. The algorithm says which operators modulate
+which: a modulator's output is added to the phase of the operators it feeds
+and the carriers' outputs are mixed into the voice. For a modulator the
+level is the modulation index in radians, for a carrier its amplitude.
+
+Operators are numbered from 1 as on the DX synths and a modulator always
+has a higher number than the operators it feeds, so rendering them from
+the highest number down evaluates the algorithm. The phases of all
+operators are accumulated together for a block, then each operator is one
+NumPy expression over the block.
+
+Operator self-feedback is not supported: it needs the operator's previous
+output sample, which cannot be computed a block at a time.
+"""
+import math
+
+import numpy as np
+
+from envelope import Envelope
+from oscillators import Oscillator
+
+# algorithm number -> (operators modulating each operator, carriers)
+ALGORITHMS = {
+    4: {
+        1: ({1: [2], 2: [3], 3: [4]}, [1]),  # 4 > 3 > 2 > 1
+        2: ({1: [2], 2: [3, 4]}, [1]),  # (3 + 4) > 2 > 1
+        3: ({1: [2, 3], 3: [4]}, [1]),  # (2 + 4 > 3) > 1
+        4: ({1: [2], 2: [4], 3: [4]}, [1, 3]),  # 4 > 2 > 1, 4 > 3
+        5: ({1: [2], 3: [4]}, [1, 3]),  # 2 > 1, 4 > 3
+        6: ({1: [4], 2: [4], 3: [4]}, [1, 2, 3]),  # 4 > 1, 2, 3
+        7: ({1: [2]}, [1, 3, 4]),  # 2 > 1, 3, 4
+        8: ({}, [1, 2, 3, 4]),  # all carriers
+    },
+    # a few of the DX7 algorithms, without the feedback loop
+    6: {
+        1: ({1: [2], 3: [4], 4: [5], 5: [6]}, [1, 3]),
+        5: ({1: [2], 3: [4], 5: [6]}, [1, 3, 5]),
+        7: ({1: [2], 3: [4, 5], 5: [6]}, [1, 3]),
+        19: ({1: [2], 2: [3], 4: [6], 5: [6]}, [1, 4, 5]),
+        32: ({}, [1, 2, 3, 4, 5, 6]),
+    },
+}
+
+# electric piano like default: two 2 > 1 stacks, a tine and a body
+DEFAULT_OPERATORS = [
+    {'ratio': 1, 'level': 1.0},
+    {'ratio': 1, 'level': 1.5, 'decay': 1.5, 'sustain': 0.2},
+    {'ratio': 1, 'level': 0.4, 'decay': 0.4, 'sustain': 0.},
+    {'ratio': 14, 'level': 1.2, 'decay': 0.2, 'sustain': 0.},
+]
+
+
+class Operator:
+    """Ratio, level and envelope of one operator."""
+
+    def __init__(self,
+                 ratio=1.,
+                 level=1.,
+                 attack=0.001,
+                 decay=0.5,
+                 sustain=1.,
+                 release=0.5,
+                 sample_rate=44_100):
+        self.ratio = ratio
+        self.level = level
+        self.envelope = Envelope(attack_duration=attack,
+                                 decay_duration=decay,
+                                 sustain_level=sustain,
+                                 release_duration=release,
+                                 sample_rate=sample_rate)
+
+
+class FMOscillator(Oscillator):
+    """FM voice with ``operators`` (dicts of Operator arguments) wired by
+    ``algorithm`` from ALGORITHMS."""
+
+    def __init__(self,
+                 freq=440,
+                 operators=None,
+                 algorithm=5,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1)):
+        super().__init__(freq, 0, amp, sample_rate, wave_range)
+        if operators is None:
+            operators = DEFAULT_OPERATORS
+        assert len(operators) in ALGORITHMS, \
+            f'FM voices have 4 or 6 operators, not {len(operators)}'
+        assert algorithm in ALGORITHMS[len(operators)], \
+            f'Invalid {len(operators)} operator algorithm: {algorithm}'
+        self.operators = [
+            Operator(sample_rate=sample_rate, **op) for op in operators
+        ]
+        self.algorithm = algorithm
+        modulators, self.carriers = ALGORITHMS[len(operators)][algorithm]
+        self.modulators = {
+            op: modulators.get(op, [])
+            for op in range(1, len(operators) + 1)
+        }
+        for op, mods in self.modulators.items():
+            assert all(mod > op for mod in mods), \
+                'a modulator must have a higher number than its target'
+        self.ratios = np.array([op.ratio for op in self.operators], float)
+
+    def _initialize_osc(self):
+        self._phases = np.zeros(len(self.operators))
+        for op in self.operators:
+            iter(op.envelope)
+
+    def __next__(self):
+        return self.render(1)[0]
+
+    def trigger_note_release(self):
+        for op in self.operators:
+            op.envelope.trigger_note_release()
+
+    @property
+    def ended(self):
+        return all(self.operators[c - 1].envelope.ended for c in self.carriers)
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        if freq is None:
+            steps = self.ratios * (2 * math.pi * self._f / self._sample_rate)
+            phases = self._phases[:, None] + np.outer(steps, np.arange(n))
+            self._phases = (self._phases + steps * n) % (2 * math.pi)
+        else:
+            steps = np.outer(self.ratios,
+                             2 * math.pi * freq / self._sample_rate)
+            phases = np.empty((len(self.operators), n))
+            phases[:, 0] = 0
+            np.cumsum(steps[:, :-1], axis=1, out=phases[:, 1:])
+            phases += self._phases[:, None]
+            self._phases = (phases[:, -1] + steps[:, -1]) % (2 * math.pi)
+            self.freq = freq[-1]
+        if phase is not None:
+            phases += np.radians(phase)
+            self.phase = phase[-1]
+
+        outputs = {}
+        for op in range(len(self.operators), 0, -1):
+            operator = self.operators[op - 1]
+            ph = phases[op - 1]
+            for mod in self.modulators[op]:
+                ph = ph + outputs[mod]
+            outputs[op] = operator.level * operator.envelope.render(n) * \
+                np.sin(ph)
+        val = sum(outputs[c] for c in self.carriers) / len(self.carriers)
+        return self._apply_amp(val, amp)
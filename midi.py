@@ -18,26 +18,18 @@ class MidiThread(QtCore.QThread):
         self.wait()
 
     def run(self):
-        notes_dict = {}
+        pending = []
         while True:
-            if notes_dict:
-                self.program_signals.midi_signal.emit((status, note, freq))
-                notes_dict = {}
+            # in the order they came, so an on/off/on of one note within a
+            # poll still ends with the note on
+            for event in pending:
+                self.program_signals.midi_signal.emit(event)
+            pending = []
             if self.midi_in.poll():
-                # Add or remove notes  from notes_dict
                 for event in self.midi_in.read(num_events=16):
                     (status, note, vel, _), _ = event
-                    if status == 0x80 and note in notes_dict:
-                        # del notes_dict[note]
-                        # freq = midi.midi_to_frequency(note)
-                        # notes_dict[note] = (status, note, freq)
-                        pass
-                    elif status == 0x90 and note not in notes_dict:
-                        pass
-                        # freq = midi.midi_to_frequency(note)
-                        # notes_dict[note] = (status, note, freq)
                     freq = pygame.midi.midi_to_frequency(note)
-                    notes_dict[note] = (status, note, freq)
+                    pending.append((status, note, freq, vel))
             time.sleep(0.01)
 
 
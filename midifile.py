@@ -0,0 +1,111 @@
+"""Minimal Standard MIDI File reader for offline rendering.
+Only what the synth understands is kept: channel messages with their time
+in seconds. Needs neither pygame nor a MIDI device.
+"""
+import struct
+
+
+def midi_to_frequency(note):
+    # Same rounding as pygame.midi.midi_to_frequency, which MidiThread uses,
+    # so offline renders match what the app plays.
+    return round(440.0 * 2**((note - 69) * (1. / 12.)), 1)
+
+
+def _read_varlen(data, pos):
+    val = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        val = (val << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return val, pos
+
+
+def _read_track(data):
+    """Yield (tick, kind, payload) for one MTrk chunk.
+
+    ``kind`` is 'tempo' (payload: microseconds per quarter note) or
+    'channel' (payload: (status, data1, data2)).
+    """
+    pos = 0
+    tick = 0
+    running_status = None
+    while pos < len(data):
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+        status = data[pos]
+        if status == 0xFF:
+            meta_type = data[pos + 1]
+            length, pos = _read_varlen(data, pos + 2)
+            if meta_type == 0x51:
+                tempo = int.from_bytes(data[pos:pos + 3], 'big')
+                yield tick, 'tempo', tempo
+            elif meta_type == 0x2F:
+                return
+            pos += length
+        elif status in (0xF0, 0xF7):
+            length, pos = _read_varlen(data, pos + 1)
+            pos += length
+        else:
+            if status & 0x80:
+                running_status = status
+                pos += 1
+            status = running_status
+            assert status is not None, 'Data byte without a status byte'
+            if status & 0xF0 in (0xC0, 0xD0):
+                data1, data2 = data[pos], 0
+                pos += 1
+            else:
+                data1, data2 = data[pos], data[pos + 1]
+                pos += 2
+            if status & 0xF0 == 0x90 and data2 == 0:
+                # note on with zero velocity is a note off
+                status = 0x80 | (status & 0x0F)
+            yield tick, 'channel', (status, data1, data2)
+
+
+def read_midi_file(path):
+    """Return the channel messages of a MIDI file sorted by time.
+
+    Each item is ``(seconds, status, data1, data2)``.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert data[:4] == b'MThd', f'Not a Standard MIDI File: {path}'
+    header_len, = struct.unpack('>I', data[4:8])
+    _, n_tracks, division = struct.unpack('>HHH', data[8:14])
+
+    pos = 8 + header_len
+    events = []
+    for track_idx in range(n_tracks):
+        chunk_type = data[pos:pos + 4]
+        chunk_len, = struct.unpack('>I', data[pos + 4:pos + 8])
+        pos += 8
+        if chunk_type == b'MTrk':
+            for order, (tick, kind, payload) in enumerate(
+                    _read_track(data[pos:pos + chunk_len])):
+                # tempo changes sort before notes on the same tick
+                events.append((tick, kind != 'tempo', track_idx, order, kind,
+                               payload))
+        pos += chunk_len
+    events.sort(key=lambda e: e[:4])
+
+    if division & 0x8000:
+        # SMPTE time code: -frames per second, ticks per frame
+        fps = 256 - (division >> 8)
+        sec_per_tick = 1 / (fps * (division & 0xFF))
+    else:
+        sec_per_tick = 500_000 / 1e6 / division
+
+    messages = []
+    last_tick = 0
+    seconds = 0.
+    for tick, _, _, _, kind, payload in events:
+        seconds += (tick - last_tick) * sec_per_tick
+        last_tick = tick
+        if kind == 'tempo':
+            if not division & 0x8000:
+                sec_per_tick = payload / 1e6 / division
+        else:
+            messages.append((seconds, *payload))
+    return messages
@@ -0,0 +1,208 @@
+"""Modulation matrix: sources routed to destinations with depths.
+
+Each block a voice stacks its source signals into a (sources, n) array and
+one matrix product with the (destinations, sources) depth matrix gives
+every destination signal, however many routes there are.
+
+Sources
+    one        constant 1, for offsets
+    env        the voice's amplitude envelope
+    lfo        the patch LFO (per voice or global), 0 when it is off
+    velocity   note on velocity, 0-1
+    mod_wheel  MIDI CC 1, 0-1
+
+Destinations
+    pitch        relative frequency deviation, freq = f * (1 + pitch)
+    amp          relative gain, amp = a * (1 + amp)
+    cutoff       Hz added to the patch cutoff, per sample; the voices
+                 share one filter, so only sources that are the same for
+                 every voice can drive it: one, mod_wheel and a global lfo
+    pulse_width  added to the square wave threshold, 0 is 50% duty
+    pan          added to the voice's stereo position, -1 left to 1 right
+
+Pitch bend and glide scale the frequency after the matrix. Both are
+computed per block as arrays of frequency ratios, which the oscillators
+accumulate into their phase like any other frequency modulation.
+"""
+import numpy as np
+
+SOURCES = ('one', 'env', 'lfo', 'velocity', 'mod_wheel')
+DESTINATIONS = ('pitch', 'amp', 'cutoff', 'pulse_width', 'pan')
+
+PITCH, AMP, CUTOFF, PULSE_WIDTH, PAN = range(len(DESTINATIONS))
+# sources the voices of a synth have in common, lfo only when it is global
+SHARED_SOURCES = ('one', 'lfo', 'mod_wheel')
+
+
+def classic_lfo_routes():
+    """The fixed routing ModulatedOscillator applies with amp_mod and
+    freq_mod, for an LFO ranging over (0.2, 1.0)."""
+    return [
+        ('lfo', 'amp', 1.0),
+        ('one', 'amp', -1.0),
+        ('lfo', 'pitch', 0.1),
+        ('one', 'pitch', -0.07),
+    ]
+
+
+def parse_route(text):
+    """'lfo:pitch:0.02' -> ('lfo', 'pitch', 0.02)"""
+    source, destination, depth = text.split(':')
+    return source, destination, float(depth)
+
+
+class ModMatrix:
+
+    def __init__(self, routes=()):
+        self.depths = np.zeros((len(DESTINATIONS), len(SOURCES)))
+        self.routed = self.depths.any(axis=1)
+        for source, destination, depth in routes:
+            self.route(source, destination, depth)
+
+    def route(self, source, destination, depth):
+        assert source in SOURCES, f'Invalid modulation source: {source}'
+        assert destination in DESTINATIONS, \
+            f'Invalid modulation destination: {destination}'
+        assert destination != 'cutoff' or source in SHARED_SOURCES, \
+            f'{source} differs from voice to voice and cannot drive the ' \
+            'shared filter cutoff'
+        self.depths[DESTINATIONS.index(destination),
+                    SOURCES.index(source)] += depth
+        self.routed = self.depths.any(axis=1)
+
+    def __call__(self, sources):
+        """(sources, n) block -> (destinations, n) block"""
+        return self.depths @ sources
+
+
+class Controls:
+    """Channel-wide controller values, read by every voice."""
+
+    def __init__(self):
+        self.mod_wheel = 0.
+        # pitch bend in semitones
+        self.bend = 0.
+
+
+class Glide:
+    """Frequency ratio sliding from ``start`` to 1 over ``samples``.
+
+    The 'exponential' curve moves at a constant rate in pitch, the
+    'linear' one at a constant rate in Hz.
+    """
+
+    def __init__(self, start, samples, curve='exponential'):
+        assert curve in ('exponential', 'linear'), \
+            f'Invalid glide curve: {curve}'
+        self.start = start
+        self.samples = max(int(samples), 1)
+        self.curve = curve
+        self.pos = 0
+
+    @property
+    def ended(self):
+        return self.pos >= self.samples
+
+    def render(self, n):
+        t = np.minimum((self.pos + np.arange(n)) / self.samples, 1)
+        self.pos += n
+        if self.curve == 'linear':
+            return self.start + (1 - self.start) * t
+        return self.start**(1 - t)
+
+
+class MatrixVoice:
+    """Oscillator, amplitude envelope and optional LFO of one note, with
+    their modulation routed through a ModMatrix."""
+
+    def __init__(self, oscillator, envelope, matrix, lfo=None, velocity=1.,
+                 controls=None, glide=None):
+        self.oscillator = oscillator
+        self.envelope = envelope
+        self.matrix = matrix
+        self.lfo = lfo
+        self.velocity = velocity
+        self.controls = controls if controls is not None else Controls()
+        self.glide = glide
+        self._bend = self.controls.bend
+        self.cutoff = None
+        self.pan = None
+
+    def __iter__(self):
+        iter(self.oscillator)
+        iter(self.envelope)
+        if self.lfo is not None:
+            iter(self.lfo)
+        return self
+
+    def __next__(self):
+        return self.render(1)[..., 0]
+
+    def trigger_note_release(self):
+        self.envelope.trigger_note_release()
+        if hasattr(self.oscillator, 'trigger_note_release'):
+            # oscillators with envelopes of their own, e.g. FM operators
+            self.oscillator.trigger_note_release()
+
+    @property
+    def ended(self):
+        return self.envelope.ended
+
+    @property
+    def silent(self):
+        return self.envelope.silent
+
+    def skip(self):
+        """Leave out the render of a silent block."""
+        self.cutoff = None
+        self.pan = None
+
+    def render(self, n):
+        env = self.envelope.render(n)
+        sources = np.empty((len(SOURCES), n))
+        sources[0] = 1.
+        sources[1] = env
+        sources[2] = 0. if self.lfo is None else self.lfo.render(n)
+        sources[3] = self.velocity
+        sources[4] = self.controls.mod_wheel
+        mod = self.matrix(sources)
+
+        routed = self.matrix.routed
+        osc = self.oscillator
+        freq = amp = None
+        if routed[PITCH]:
+            freq = osc.init_freq * (1 + mod[PITCH])
+        ratio = self._pitch_ratio(n)
+        if ratio is not None:
+            freq = (osc.init_freq if freq is None else freq) * ratio
+        if routed[AMP]:
+            amp = osc.init_amp * (1 + mod[AMP])
+        if routed[PULSE_WIDTH] and hasattr(osc, 'threshold'):
+            val = osc.render(n, freq=freq, amp=amp,
+                             threshold=osc.threshold + mod[PULSE_WIDTH])
+        else:
+            val = osc.render(n, freq=freq, amp=amp)
+        self.cutoff = mod[CUTOFF] if routed[CUTOFF] else None
+        self.pan = mod[PAN] if routed[PAN] else None
+        return val * env
+
+    def _pitch_ratio(self, n):
+        """Frequency ratio of glide and pitch bend for the next ``n``
+        samples, or None when neither is on."""
+        ratio = None
+        if self.glide is not None:
+            ratio = self.glide.render(n)
+            if self.glide.ended:
+                self.glide = None
+        bend = self.controls.bend
+        if bend != self._bend:
+            # ramp from the last bend over the block, no zipper steps
+            semitones = self._bend + (bend - self._bend) * np.arange(
+                1, n + 1) / n
+            self._bend = bend
+            bent = 2**(semitones / 12)
+        elif bend != 0:
+            bent = np.full(n, 2**(bend / 12))
+        else:
+            return ratio
+        return bent if ratio is None else ratio * bent
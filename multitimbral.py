@@ -0,0 +1,157 @@
+"""Multitimbral engine: one patch and voice budget per MIDI channel.
+
+Each of the 16 channels plays its own Synth, created on its first message
+with the channel's patch. Channels without a patch of their own share the
+default patch, so a set_param on channel 0 changes all of them. The
+channels' blocks are summed and, optionally, passed through the effects
+of a ``master`` patch, e.g. its limiter.
+
+``max_voices`` caps the voices of all channels together. When a note
+would go over it, the channel using the largest share of its own budget
+gives up its oldest voice, so a channel playing many notes steals from
+itself before it can take voices from quieter ones.
+"""
+import json
+
+from engine import Patch, Synth, build_effects, silence
+
+CHANNELS = 16
+
+
+def parse_parts(parts):
+    """Patches and voice budgets by channel (0-15) of a mapping like
+    ``{"10": {"wave_type": "white", "voices": 4}}``: Patch keyword
+    arguments and an optional budget by MIDI channel (1-16)."""
+    patches, budgets = {}, {}
+    for channel, kwargs in parts.items():
+        channel = int(channel) - 1
+        kwargs = dict(kwargs)
+        if 'voices' in kwargs:
+            budgets[channel] = kwargs.pop('voices')
+            assert budgets[channel] >= 1, \
+                f'Channel {channel + 1} needs a budget of at least 1 voice'
+        patches[channel] = Patch(**kwargs)
+    return patches, budgets
+
+
+def load_parts(path):
+    """parse_parts of the JSON file at ``path``."""
+    with open(path) as f:
+        return parse_parts(json.load(f))
+
+
+class Multitimbral:
+    """Same calls as Synth, with a ``channel`` (0-15) for every message."""
+
+    def __init__(self, patch=None, patches=None, budgets=None, master=None,
+                 sample_rate=22_050, max_voices=16, threads=1, seed=0,
+                 block_size=256, oversample=1, channels=1):
+        self.patch = patch if patch is not None else Patch()
+        self.patches = dict(patches or {})
+        self.budgets = dict(budgets or {})
+        self.max_voices = max_voices
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.seed = seed
+        self.synth_args = dict(sample_rate=sample_rate,
+                               threads=threads,
+                               block_size=block_size,
+                               oversample=oversample,
+                               channels=channels)
+        self.parts = {}
+        self.effects = build_effects(master, sample_rate, block_size) \
+            if master is not None else []
+
+    def part(self, channel):
+        """The Synth of ``channel``, created on first use."""
+        assert 0 <= channel < CHANNELS, f'Invalid MIDI channel {channel}'
+        if channel not in self.parts:
+            self.budgets.setdefault(channel, self.max_voices)
+            # channel 0 keeps the noise streams of a single Synth
+            seed = self.seed if channel == 0 else (self.seed, channel)
+            self.parts[channel] = Synth(self.patches.get(channel, self.patch),
+                                        max_voices=self.budgets[channel],
+                                        seed=seed,
+                                        **self.synth_args)
+        return self.parts[channel]
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+
+    @property
+    def voice_count(self):
+        return sum(len(part.voices) for part in self.parts.values())
+
+    @property
+    def active(self):
+        return any(part.active for part in self.parts.values()) or not all(
+            effect.idle for effect in self.effects)
+
+    @property
+    def ended(self):
+        return all(part.ended for part in self.parts.values()) and all(
+            effect.idle for effect in self.effects)
+
+    @property
+    def skipped_voice_blocks(self):
+        return sum(part.skipped_voice_blocks for part in self.parts.values())
+
+    @property
+    def latency(self):
+        latency = sum(getattr(e, 'latency', 0) for e in self.effects)
+        return latency + max(
+            (part.latency for part in self.parts.values()), default=0)
+
+    @property
+    def dynamics_metrics(self):
+        metrics = {}
+        for channel, part in sorted(self.parts.items()):
+            for name, values in part.dynamics_metrics.items():
+                metrics[f'channel {channel + 1} {name}'] = values
+        for effect in self.effects:
+            if hasattr(effect, 'metrics'):
+                metrics[f'master {type(effect).__name__.lower()}'] = \
+                    effect.metrics
+        return metrics
+
+    def set_param(self, name, value, timestamp=None, channel=0):
+        self.part(channel).set_param(name, value, timestamp)
+
+    def control_change(self, controller, value, channel=0):
+        self.part(channel).control_change(controller, value)
+
+    def pitch_bend(self, value, channel=0):
+        self.part(channel).pitch_bend(value)
+
+    def note_on(self, freq, note=None, velocity=127, channel=0):
+        part = self.part(channel)
+        retrigger = note is not None and any(
+            voice.note == note for voice in part.voices)
+        if not retrigger and len(part.voices) < self.budgets[channel] and \
+                self.voice_count >= self.max_voices:
+            self._steal_for(channel)
+        part.note_on(freq, note=note, velocity=velocity)
+
+    def _steal_for(self, channel):
+        # share of its budget every channel would use with the new note
+        def share(c):
+            used = len(self.parts[c].voices) + (c == channel)
+            return used / self.budgets[c]
+
+        victim = max((c for c, part in self.parts.items() if part.voices),
+                     key=share)
+        self.parts[victim].steal_voice()
+
+    def note_off(self, note=None, channel=0):
+        if channel in self.parts:
+            self.parts[channel].note_off(note=note)
+
+    def render(self, n):
+        buf = silence(n, self.channels)
+        for part in self.parts.values():
+            if part.active:
+                buf = buf + part.render(n)
+        for effect in self.effects:
+            buf = effect(buf)
+        return buf
@@ -2,13 +2,21 @@
 Making A Synth With Python
 https://python.plainenglish.io/making-a-synth-with-python-oscillators-2cb8e68e9c3b
 """
+import functools
 import math
 from abc import ABC, abstractmethod
 from collections.abc import Iterable
+
+import numpy as np
 import scipy.signal
 
 
-def get_osc_by_type(wave_type, freq, sample_rate, wave_range=None):
+def get_osc_by_type(wave_type,
+                    freq,
+                    sample_rate,
+                    wave_range=None,
+                    seed=None,
+                    wavetable=None):
     if wave_range is None:
         wave_range = (-1, 1)
     if wave_type == 'sine':
@@ -27,6 +35,16 @@ def get_osc_by_type(wave_type, freq, sample_rate, wave_range=None):
         return TriangleOscillator(freq,
                                   wave_range=wave_range,
                                   sample_rate=sample_rate)
+    elif wave_type in NOISE_TYPES:
+        return NOISE_TYPES[wave_type](freq,
+                                      wave_range=wave_range,
+                                      sample_rate=sample_rate,
+                                      seed=seed)
+    elif wave_type == 'wavetable':
+        return WavetableOscillator(freq,
+                                   wavetable=wavetable,
+                                   wave_range=wave_range,
+                                   sample_rate=sample_rate)
     assert False, f'Invalid wave_type: {wave_type}'
 
 
@@ -118,6 +136,33 @@ class Oscillator(ABC):
         self._initialize_osc()
         return self
 
+    def render(self, n, freq=None, amp=None, phase=None):
+        """Next ``n`` samples as an array.
+
+        ``freq``, ``amp`` and ``phase`` are optional per-sample arrays that
+        are applied exactly as the setters would be before each ``next()``.
+        Subclasses override this with a vectorized version; this fallback
+        just steps the generator.
+        """
+        out = np.empty(n)
+        for k in range(n):
+            if amp is not None:
+                self.amp = amp[k]
+            if freq is not None:
+                self.freq = freq[k]
+            if phase is not None:
+                self.phase = phase[k]
+            out[k] = next(self)
+        return out
+
+    def _apply_amp(self, val, amp):
+        if self._wave_range != (-1, 1):
+            val = self.squish_val(val, *self._wave_range)
+        if amp is None:
+            return val * self._a
+        self.amp = amp[-1]
+        return val * amp
+
 
 class SineOscillator(Oscillator):
 
@@ -137,6 +182,28 @@ class SineOscillator(Oscillator):
             val = self.squish_val(val, *self._wave_range)
         return val * self._a
 
+    def _render_phase(self, n, freq, phase):
+        # phase accumulation: sample k sees the steps of samples 0..k-1
+        if freq is None:
+            i = self._i + self._step * np.arange(n)
+            self._i = self._i + self._step * n
+        else:
+            steps = 2 * math.pi * freq / self._sample_rate
+            i = np.empty(n)
+            i[0] = self._i
+            np.cumsum(steps[:-1], out=i[1:])
+            i[1:] += self._i
+            self._i = i[-1] + steps[-1]
+            self.freq = freq[-1]
+        if phase is None:
+            return i + self._p
+        self.phase = phase[-1]
+        return i + np.radians(phase)
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        val = np.sin(self._render_phase(n, freq, phase))
+        return self._apply_amp(val, amp)
+
 
 class SquareOscillator(SineOscillator):
 
@@ -159,6 +226,16 @@ class SquareOscillator(SineOscillator):
             val = self._wave_range[1]
         return val * self._a
 
+    def render(self, n, freq=None, amp=None, phase=None, threshold=None):
+        val = np.sin(self._render_phase(n, freq, phase))
+        if threshold is None:
+            threshold = self.threshold
+        val = np.where(val < threshold, *self._wave_range)
+        if amp is None:
+            return val * self._a
+        self.amp = amp[-1]
+        return val * amp
+
 
 class SawtoothOscillator(Oscillator):
 
@@ -180,6 +257,43 @@ class SawtoothOscillator(Oscillator):
             val = self.squish_val(val, *self._wave_range)
         return val * self._a
 
+    def _render_saw(self, n, freq, phase):
+        if freq is None:
+            i = self._i + np.arange(n)
+            self._i = self._i + n
+            if phase is None:
+                p = self._p
+            else:
+                p = ((phase + 90) / 360) * self._period
+                self.phase = phase[-1]
+            div = (i + p) / self._period
+            return 2 * (div - np.floor(0.5 + div))
+
+        # phase accumulation in cycles: sample k sees the steps of samples
+        # 0..k-1, so a changing freq bends the pitch instead of the index
+        steps = freq / self._sample_rate
+        cycles = np.empty(n)
+        cycles[0] = self._i / self._period
+        np.cumsum(steps[:-1], out=cycles[1:])
+        cycles[1:] += cycles[0]
+        end = cycles[-1] + steps[-1]
+        offset = self._p / self._period
+        # carry the position and phase over to the new period, so the
+        # scalar path above goes on where this one stops
+        self.freq = freq[-1]
+        self._i = end * self._period
+        self._p = offset * self._period
+        if phase is None:
+            div = cycles + offset
+        else:
+            div = cycles + (phase + 90) / 360
+            self.phase = phase[-1]
+        return 2 * (div - np.floor(0.5 + div))
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        val = self._render_saw(n, freq, phase)
+        return self._apply_amp(val, amp)
+
 
 class TriangleOscillator(SawtoothOscillator):
 
@@ -192,6 +306,258 @@ class TriangleOscillator(SawtoothOscillator):
             val = self.squish_val(val, *self._wave_range)
         return val * self._a
 
+    def render(self, n, freq=None, amp=None, phase=None):
+        val = (np.abs(self._render_saw(n, freq, phase)) - 0.5) * 2
+        return self._apply_amp(val, amp)
+
+
+class NoiseOscillator(Oscillator):
+    """Noise drawn a block at a time from a seeded numpy Generator.
+
+    ``seed`` is anything np.random.default_rng accepts, typically a
+    SeedSequence spawned by the synth, and restarting the oscillator
+    restarts the sequence, so renders are reproducible. ``freq`` is
+    ignored.
+    """
+
+    def __init__(self,
+                 freq=440,
+                 phase=0,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1),
+                 seed=None):
+        super().__init__(freq, phase, amp, sample_rate, wave_range)
+        self.seed = seed
+
+    def _initialize_osc(self):
+        self._rng = np.random.default_rng(self.seed)
+
+    def __next__(self):
+        return self.render(1)[0]
+
+    def _noise(self, n):
+        return self._rng.uniform(-1, 1, n)
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        if freq is not None:
+            self.freq = freq[-1]
+        return self._apply_amp(self._noise(n), amp)
+
+
+class WhiteNoiseOscillator(NoiseOscillator):
+    pass
+
+
+class PinkNoiseOscillator(NoiseOscillator):
+    """White noise through Paul Kellet's 3 pole -3 dB/octave filter, whose
+    state is kept between blocks."""
+
+    b = [0.049922035, -0.095993537, 0.050612699, -0.004408786]
+    a = [1, -2.494956002, 2.017265875, -0.522189400]
+    gain = 4.  # about the level of the other waves, peaks near +-1
+
+    def _initialize_osc(self):
+        super()._initialize_osc()
+        self._zi = np.zeros(len(self.a) - 1)
+
+    def _noise(self, n):
+        val, self._zi = scipy.signal.lfilter(self.b, self.a,
+                                             super()._noise(n),
+                                             zi=self._zi)
+        return self.gain * val
+
+
+class BrownNoiseOscillator(NoiseOscillator):
+    """White noise through a leaky integrator (-6 dB/octave above 20 Hz)."""
+
+    corner = 20
+
+    def _initialize_osc(self):
+        super()._initialize_osc()
+        self._leak = math.exp(-2 * math.pi * self.corner / self._sample_rate)
+        # same RMS as the pink noise for uniform white noise
+        rms = math.sqrt((1 - self._leak) / (1 + self._leak) / 3)
+        self._gain = 0.2 / rms
+        self._zi = np.zeros(1)
+
+    def _noise(self, n):
+        val, self._zi = scipy.signal.lfilter([1 - self._leak],
+                                             [1, -self._leak],
+                                             super()._noise(n),
+                                             zi=self._zi)
+        return self._gain * val
+
+
+NOISE_TYPES = {
+    'white': WhiteNoiseOscillator,
+    'pink': PinkNoiseOscillator,
+    'brown': BrownNoiseOscillator,
+}
+
+
+class WavetableOscillator(Oscillator):
+    """Plays a (levels, frames, size) stack of band-limited mip-maps.
+
+    Level ``l`` holds the frames with only the lowest size/2 >> l
+    harmonics; every block plays the lowest level with no harmonic above
+    Nyquist at the block's highest frequency. ``position`` (0-1) morphs
+    linearly across the frames; a change glides over the next block.
+    """
+
+    def __init__(self,
+                 freq=440,
+                 wavetable=None,
+                 position=0.,
+                 phase=0,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1)):
+        assert wavetable is not None and wavetable.ndim == 3, \
+            'WavetableOscillator needs a (levels, frames, size) table'
+        super().__init__(freq, phase, amp, sample_rate, wave_range)
+        self.wavetable = wavetable
+        self.position = position
+        self._last_position = position
+
+    def _initialize_osc(self):
+        self._cycle = 0.
+        self._last_position = self.position
+
+    def __next__(self):
+        return self.render(1)[0]
+
+    def _level(self, max_freq):
+        levels, _, size = self.wavetable.shape
+        harmonics = (size // 2) * max_freq / (self._sample_rate / 2)
+        level = math.ceil(math.log2(harmonics)) if harmonics > 1 else 0
+        return min(max(level, 0), levels - 1)
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        _, frames, size = self.wavetable.shape
+        if freq is None:
+            steps = np.full(n, self._f / self._sample_rate)
+            max_freq = self._f
+        else:
+            steps = freq / self._sample_rate
+            max_freq = freq.max()
+            self.freq = freq[-1]
+        cycles = np.empty(n)
+        cycles[0] = 0
+        np.cumsum(steps[:-1], out=cycles[1:])
+        cycles += self._cycle
+        self._cycle = (cycles[-1] + steps[-1]) % 1.
+        if phase is None:
+            cycles += self._p / 360
+        else:
+            cycles += phase / 360
+            self.phase = phase[-1]
+
+        morph = np.linspace(self._last_position, self.position, n)
+        pos = morph * (frames - 1)
+        self._last_position = self.position
+        table = self.wavetable[self._level(max_freq)]
+        x = (cycles % 1.) * size
+        i = x.astype(int) % size
+        j = (i + 1) % size
+        frac = x - np.floor(x)
+        f = np.minimum(pos.astype(int), frames - 1)
+        g = np.minimum(f + 1, frames - 1)
+        w = pos - f
+        a = table[f, i] + frac * (table[f, j] - table[f, i])
+        b = table[g, i] + frac * (table[g, j] - table[g, i])
+        return self._apply_amp(a + w * (b - a), amp)
+
+
+class UnisonOscillator(Oscillator):
+    """``voices`` detuned copies of one basic waveform.
+
+    Every copy has its own phase accumulator, in cycles, and the copies of
+    a block are rendered together as one (voices, n) array. They are spread
+    evenly over ``detune`` cents around the played frequency and, with
+    ``stereo``, panned evenly over ``spread`` (0 centre, 1 hard left to
+    hard right), giving a (2, n) block. Copies are summed with 1/sqrt(voices)
+    gain so the loudness stays roughly that of a single oscillator.
+    """
+
+    def __init__(self,
+                 wave_type='sawtooth',
+                 freq=440,
+                 phase=0,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1),
+                 voices=7,
+                 detune=20.,
+                 spread=1.,
+                 stereo=False,
+                 threshold=0):
+        assert wave_type in ('sine', 'square', 'sawtooth', 'triangle'), \
+            f'Invalid wave_type: {wave_type}'
+        assert voices >= 1, f'Invalid unison voices: {voices}'
+        super().__init__(freq, phase, amp, sample_rate, wave_range)
+        self.wave_type = wave_type
+        self.voices = voices
+        self.threshold = threshold
+        self.ratios = 2**(self._offsets(voices, detune) / 1200)
+        gain = 1 / math.sqrt(voices)
+        if stereo:
+            # equal power pan law, pan angle 0 is left and pi/2 right
+            angles = (self._offsets(voices, 2 * spread) + 1) * math.pi / 4
+            self.gains = gain * np.stack([np.cos(angles), np.sin(angles)])
+        else:
+            self.gains = np.full(voices, gain)
+        # fixed start phases, so copies do not all cancel or peak together
+        self._start = np.random.default_rng(voices).random(voices)
+        self._start[voices // 2] = 0
+
+    @staticmethod
+    def _offsets(voices, width):
+        # evenly spaced over width, centred on 0
+        return width * (np.arange(voices) - (voices - 1) / 2) / max(
+            voices - 1, 1)
+
+    def _initialize_osc(self):
+        self._phases = self._start.copy()
+
+    def __next__(self):
+        return self.render(1)[..., 0]
+
+    def _wave(self, phases, threshold):
+        if self.wave_type in ('sine', 'square'):
+            val = np.sin(2 * math.pi * phases)
+            if self.wave_type == 'square':
+                val = np.where(val < threshold, -1., 1.)
+            return val
+        # same quarter cycle offset as SawtoothOscillator
+        div = phases + 0.25
+        val = 2 * (div - np.floor(0.5 + div))
+        if self.wave_type == 'triangle':
+            val = (np.abs(val) - 0.5) * 2
+        return val
+
+    def render(self, n, freq=None, amp=None, phase=None, threshold=None):
+        if freq is None:
+            steps = self.ratios * (self._f / self._sample_rate)
+            phases = self._phases[:, None] + np.outer(steps, np.arange(n))
+            self._phases = (self._phases + steps * n) % 1.
+        else:
+            steps = np.outer(self.ratios, freq / self._sample_rate)
+            phases = np.empty((self.voices, n))
+            phases[:, 0] = 0
+            np.cumsum(steps[:, :-1], axis=1, out=phases[:, 1:])
+            phases += self._phases[:, None]
+            self._phases = (phases[:, -1] + steps[:, -1]) % 1.
+            self.freq = freq[-1]
+        if phase is None:
+            phases += self._p / 360
+        else:
+            phases += phase / 360
+            self.phase = phase[-1]
+        copies = self._wave(phases,
+                            self.threshold if threshold is None else threshold)
+        return self._apply_amp(self.gains @ copies, amp)
+
 
 def amp_mode(init_amp, env):
     return env * init_amp
@@ -211,6 +577,10 @@ class ModulatedOscillator:
         self.freq_mod = freq_mod
         self.phase_mod = phase_mod
         self._modulators_count = len(modulators)
+        # parts that can end, looked up once instead of on every query
+        self._enders = [m for m in modulators if hasattr(m, "ended")]
+        if hasattr(oscillator, "ended"):
+            self._enders.append(oscillator)
 
     def __iter__(self):
         iter(self.oscillator)
@@ -255,14 +625,31 @@ class ModulatedOscillator:
 
     @property
     def ended(self):
-        e = "ended"
-        ended = []
-        for modulator in self.modulators:
-            if hasattr(modulator, e):
-                ended.append(modulator.ended)
-        if hasattr(self.oscillator, e):
-            ended.append(self.oscillator.ended)
-        return all(ended)
+        return all(part.ended for part in self._enders)
+
+
+class SharedModulator:
+    """Modulator rendered once per block and read by many voices.
+
+    The owner calls advance(n) before the voices render; each voice's
+    render(n) then returns the same block. Block rendering only.
+    """
+
+    def __init__(self, generator):
+        self.generator = iter(generator)
+        self.block = None
+
+    def advance(self, n):
+        self.block = self.generator.render(n)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise TypeError('SharedModulator only supports render()')
+
+    def render(self, n):
+        return self.block[:n]
 
 
 class Chain:
@@ -270,6 +657,9 @@ class Chain:
     def __init__(self, generator, *modifiers):
         self.generator = generator
         self.modifiers = modifiers
+        self._enders = [m for m in modifiers if hasattr(m, "ended")]
+        if hasattr(generator, "ended"):
+            self._enders.insert(0, generator)
 
     def __getattr__(self, attr):
         val = None
@@ -294,12 +684,7 @@ class Chain:
 
     @property
     def ended(self):
-        ended = []
-        e = "ended"
-        if hasattr(self.generator, e):
-            ended.append(self.generator.ended)
-        ended.extend([m.ended for m in self.modifiers if hasattr(m, e)])
-        return all(ended)
+        return all(part.ended for part in self._enders)
 
     def __iter__(self):
         iter(self.generator)
@@ -333,6 +718,7 @@ class ModulatedVolume(Volume):
     def __init__(self, modulator):
         super().__init__(0.)
         self.modulator = modulator
+        self._can_end = hasattr(modulator, "ended")
 
     def __iter__(self):
         iter(self.modulator)
@@ -348,10 +734,7 @@ class ModulatedVolume(Volume):
 
     @property
     def ended(self):
-        ended = False
-        if hasattr(self.modulator, "ended"):
-            ended = self.modulator.ended
-        return ended
+        return self._can_end and self.modulator.ended
 
 
 def amp_mod(init_amp, env):
@@ -372,6 +755,7 @@ class WaveAdder:
     def __init__(self, *generators, stereo=False):
         self.generators = generators
         self.stereo = stereo
+        self._enders = [gen for gen in generators if hasattr(gen, "ended")]
 
     def _mod_channels(self, _val):
         val = _val
@@ -389,8 +773,7 @@ class WaveAdder:
 
     @property
     def ended(self):
-        ended = [gen.ended for gen in self.generators if hasattr(gen, "ended")]
-        return all(ended)
+        return all(gen.ended for gen in self._enders)
 
     def __iter__(self):
         [iter(gen) for gen in self.generators]
@@ -405,15 +788,135 @@ class WaveAdder:
             val = sum(vals) / len(vals)
         return val
 
+    def _mod_block(self, block):
+        if block.ndim == 1 and self.stereo:
+            block = np.stack((block, block))
+        elif block.ndim == 2 and not self.stereo:
+            block = block.mean(axis=0)
+        return block
+
+    def render(self, n):
+        """Next ``n`` samples, shaped (n,) or (2, n) when stereo."""
+        vals = [self._mod_block(gen.render(n)) for gen in self.generators]
+        return sum(vals) / len(vals)
+
+
+@functools.lru_cache(maxsize=1024)
+def butter_coefficients(order, cutoff, sample_rate):
+    nyq = sample_rate * 0.5
+    normal_cutoff = cutoff / nyq
+    return scipy.signal.butter(order, normal_cutoff, btype='low')
+
 
 def lowpass_filter(wave, sample_rate, cutoff, order, lpf_intensity=1.0):
     assert 0 < lpf_intensity <= 1.0
     if cutoff <= 0:
         return wave
-    nyq = sample_rate * 0.5
-    normal_cutoff = cutoff / nyq
-    b, a = scipy.signal.butter(order, normal_cutoff, btype='low')
+    b, a = butter_coefficients(order, cutoff, sample_rate)
     wave2 = scipy.signal.lfilter(b, a, wave)
     wave = lpf_intensity * wave2 + (1.0 - lpf_intensity) * wave
 
     return wave
+
+
+@functools.lru_cache(maxsize=1024)
+def butter_sos(order, cutoff, sample_rate):
+    nyq = sample_rate * 0.5
+    return scipy.signal.butter(order, cutoff / nyq, btype='low', output='sos')
+
+
+class LowpassFilter:
+    """Butterworth low pass that keeps its state from block to block.
+
+    ``wave`` is (n,) or (channels, n), each channel filtered on its own.
+    ``cutoff`` and ``lpf_intensity`` may be per-sample arrays. A changing
+    cutoff is followed in segments of ``segment`` samples, each filtered
+    with the coefficients at its start; a cutoff of 0 bypasses the filter
+    like in lowpass_filter().
+    """
+
+    def __init__(self, sample_rate, order=5, segment=32):
+        self.sample_rate = sample_rate
+        self.order = order
+        self.segment = segment
+        self.zi = None
+
+    @property
+    def idle(self):
+        """True when the filter would output silence for silent input."""
+        return self.zi is None or np.abs(self.zi).max() < 1e-9
+
+    def _filter(self, wave, cutoff):
+        sos = butter_sos(self.order, cutoff, self.sample_rate)
+        shape = (sos.shape[0], ) + wave.shape[:-1] + (2, )
+        if self.zi is None or self.zi.shape != shape:
+            self.zi = np.zeros(shape)
+        out, self.zi = scipy.signal.sosfilt(sos, wave, zi=self.zi)
+        return out
+
+    def __call__(self, wave, cutoff, lpf_intensity=1.0):
+        if np.ndim(cutoff) == 0:
+            if cutoff <= 0:
+                self.zi = None
+                return wave
+            wet = self._filter(wave, cutoff)
+        else:
+            wet = np.empty_like(wave)
+            n = wave.shape[-1]
+            # round so that ramps reuse cached coefficients
+            seg_cutoffs = np.round(cutoff[::self.segment])
+            # runs of segments with the same cutoff are filtered in one go
+            changes = np.flatnonzero(np.diff(seg_cutoffs)) + 1
+            starts = np.concatenate(([0], changes)) * self.segment
+            ends = np.append(starts[1:], n)
+            for start, end in zip(starts, ends):
+                seg_cutoff = seg_cutoffs[start // self.segment]
+                if seg_cutoff <= 0:
+                    self.zi = None
+                    wet[..., start:end] = wave[..., start:end]
+                else:
+                    wet[..., start:end] = self._filter(
+                        wave[..., start:end], int(seg_cutoff))
+        return lpf_intensity * wet + (1.0 - lpf_intensity) * wave
+
+
+class Decimator:
+    """Low pass and keep every ``factor``-th sample, block by block.
+
+    The anti-aliasing FIR is designed once like scipy.signal.resample_poly
+    designs it, ``half_length`` output samples either side of the centre.
+    Only the kept outputs are computed: each is one dot product of the taps
+    with a strided window over the block and the end of the one before.
+    Blocks, (n,) or (channels, n), must be a multiple of ``factor`` long.
+    The output is delayed by ``latency`` samples.
+    """
+
+    def __init__(self, factor, half_length=10):
+        self.factor = factor
+        self.latency = half_length
+        n_taps = 2 * half_length * factor + 1
+        self.taps = scipy.signal.firwin(n_taps,
+                                        1 / factor,
+                                        window=('kaiser', 5.0))[::-1]
+        self._history = np.zeros(n_taps - 1)
+
+    @property
+    def idle(self):
+        return not self._history.any()
+
+    def __call__(self, wave):
+        n = wave.shape[-1]
+        assert n % self.factor == 0, \
+            f'{n} samples do not decimate by {self.factor}'
+        history = self._history
+        if history.shape[:-1] != wave.shape[:-1]:
+            history = np.zeros(wave.shape[:-1] + history.shape[-1:])
+        if not history.any() and not wave.any():
+            self._history = history
+            return np.zeros(wave.shape[:-1] + (n // self.factor, ))
+        z = np.concatenate((history, wave), axis=-1)
+        self._history = z[..., n:]
+        # output i is centred on input sample (i - latency) * factor
+        windows = np.lib.stride_tricks.sliding_window_view(
+            z, len(self.taps), axis=-1)[..., :n:self.factor, :]
+        return windows @ self.taps
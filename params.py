@@ -0,0 +1,85 @@
+"""Parameters that change smoothly inside a block.
+
+A change is queued with the time it was made and applied by the next
+render as a ramp starting at the matching sample of that block. All
+changes queued during one block are coalesced into a single ramp towards
+the newest value, so a fast dial sweep costs one ramp per block.
+"""
+import math
+import time
+
+import numpy as np
+
+
+class SmoothedParam:
+
+    def __init__(self, value, sample_rate, ramp_time=0.02, mode='linear'):
+        assert mode in ('linear', 'one_pole'), f'Invalid mode: {mode}'
+        self.value = value
+        self.mode = mode
+        self.pending = []
+        # linear: ramp length in samples; one_pole: time constant
+        self._length = max(ramp_time * sample_rate, 1)
+        self._coef = math.exp(-1 / self._length)
+        self._from = value
+        self._to = value
+        self._pos = 0
+
+    @property
+    def target(self):
+        return self.pending[-1][1] if self.pending else self._to
+
+    @property
+    def ramping(self):
+        return bool(self.pending) or self.value != self._to
+
+    def set(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self.pending.append((timestamp, value))
+
+    def jump(self, value):
+        """Set the value at once, dropping any queued change or ramp."""
+        self.pending = []
+        self.value = self._from = self._to = value
+
+    def render(self, n, window=None):
+        """Values of the next ``n`` samples.
+
+        ``window`` is the (start, end) time span the block stands for; a
+        queued change lands on the sample its timestamp falls on. Without
+        it changes start at the first sample.
+        """
+        pending, self.pending = self.pending, []
+        if not pending and self.value == self._to:
+            return np.full(n, self.value)
+
+        out = np.empty(n)
+        offset = 0
+        if pending:
+            if window is not None and window[1] > window[0]:
+                frac = (pending[0][0] - window[0]) / (window[1] - window[0])
+                offset = min(max(int(frac * n), 0), n - 1)
+            out[:offset] = self._advance(offset)
+            self._from = self.value
+            self._to = pending[-1][1]
+            self._pos = 0
+        out[offset:] = self._advance(n - offset)
+        return out
+
+    def _advance(self, m):
+        if m == 0:
+            return np.empty(0)
+        k = self._pos + np.arange(1, m + 1)
+        self._pos += m
+        if self.mode == 'linear':
+            vals = self._from + (self._to - self._from) * np.minimum(
+                k / self._length, 1)
+            done = self._pos >= self._length
+        else:
+            vals = self._to + (self._from - self._to) * self._coef**k
+            done = abs(vals[-1] - self._to) < 1e-6 * max(abs(self._to), 1)
+        if done:
+            vals[-1] = self._to
+        self.value = vals[-1]
+        return vals
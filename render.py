@@ -0,0 +1,353 @@
+"""Render a Standard MIDI File to WAV, without the Qt UI or an audio device.
+
+    python render.py song.mid -o song.wav --wave sawtooth --cutoff 2000
+    python render.py --batch jobs.json --out-dir renders
+
+Audio is rendered in large blocks through the same Synth the app plays and
+streamed straight to the WAV file, so memory stays flat for long files.
+
+A batch file is a JSON list of jobs such as
+``{"midi": "song.mid", "output": "song.wav", "patch": {"cutoff": 2000}}``
+where "patch" holds Patch keyword arguments and "output", "seed" and
+"parts" are optional.
+
+Every MIDI channel plays the patch from the options unless a parts file
+(--parts, or "parts" in a job) gives it its own, e.g.
+``{"10": {"wave_type": "white", "release_duration": 0.1, "voices": 4}}``
+with Patch keyword arguments and an optional voice budget per channel
+(1-16). --voices caps the voices of all channels together.
+Jobs are spread over one worker process per core and a manifest.json with
+the render times is written next to the WAV files.
+"""
+import argparse
+import json
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+
+from config import EngineConfig, add_config_arguments, config_from_args
+from engine import Patch, to_int16
+from midifile import midi_to_frequency, read_midi_file
+from modmatrix import parse_route
+from multitimbral import Multitimbral, parse_parts
+
+WAVE_TYPES = [
+    'sine', 'square', 'sawtooth', 'triangle', 'white', 'pink', 'brown'
+]
+# wave types only the main oscillator can play
+VOICE_WAVE_TYPES = WAVE_TYPES + ['additive', 'fm', 'sampler', 'wavetable']
+
+
+def add_patch_arguments(parser):
+    defaults = Patch()
+    parser.add_argument('--wave', default=defaults.wave_type,
+                        choices=VOICE_WAVE_TYPES)
+    parser.add_argument('--partials', type=int, default=defaults.partials,
+                        help='harmonics of the additive wave')
+    parser.add_argument('--fm-algorithm', type=int,
+                        default=defaults.fm_algorithm,
+                        help='operator algorithm of the fm wave, see fm.py')
+    parser.add_argument('--samples', default=defaults.sample_library,
+                        help='JSON sample library of the sampler wave, '
+                        'see sampler.py')
+    parser.add_argument('--wavetable', default=defaults.wavetable,
+                        help='WAV file of the wavetable wave')
+    parser.add_argument('--wavetable-position', type=float,
+                        default=defaults.wavetable_position,
+                        help='morph across the wavetable frames, 0-1')
+    parser.add_argument('--unison', type=int, default=defaults.unison,
+                        help='detuned copies of the main oscillator')
+    parser.add_argument('--unison-detune', type=float,
+                        default=defaults.unison_detune,
+                        help='spread of the unison copies in cents')
+    parser.add_argument('--unison-spread', type=float,
+                        default=defaults.unison_spread,
+                        help='stereo width of the unison copies, 0-1')
+    parser.add_argument('--pan', type=float, default=defaults.pan,
+                        help='stereo position, -1 left to 1 right')
+    parser.add_argument('--pan-spread', type=float,
+                        default=defaults.pan_spread,
+                        help='spread notes over the stereo field by key')
+    parser.add_argument('--bend-range', type=float,
+                        default=defaults.bend_range,
+                        help='semitones of a full pitch bend')
+    parser.add_argument('--glide', type=float, default=defaults.glide,
+                        help='portamento time in seconds')
+    parser.add_argument('--glide-curve', default=defaults.glide_curve,
+                        choices=['exponential', 'linear'])
+    parser.add_argument('--glide-legato', action='store_true',
+                        help='glide only from a note that is still held')
+    parser.add_argument('--lfo-wave', default=defaults.lfo_wave_type,
+                        choices=WAVE_TYPES)
+    parser.add_argument('--lfo-freq', type=float, default=defaults.lfo_freq,
+                        help='LFO frequency in Hz, 0 disables the LFO')
+    parser.add_argument('--lfo-global', action='store_true',
+                        help='share one LFO between all voices')
+    parser.add_argument('--attack', type=float,
+                        default=defaults.attack_duration, help='seconds')
+    parser.add_argument('--decay', type=float,
+                        default=defaults.decay_duration, help='seconds')
+    parser.add_argument('--sustain', type=float,
+                        default=defaults.sustain_level, help='level, 0-1')
+    parser.add_argument('--release', type=float,
+                        default=defaults.release_duration, help='seconds')
+    parser.add_argument('--cutoff', type=float, default=defaults.cutoff,
+                        help='low pass cutoff in Hz, 0 disables the filter')
+    parser.add_argument('--lpf-intensity', type=float,
+                        default=defaults.lpf_intensity)
+    parser.add_argument('--chorus', type=float, default=defaults.chorus,
+                        help='chorus mix, 0-1, 0 disables the chorus')
+    parser.add_argument('--tempo', type=float, default=defaults.tempo,
+                        help='BPM the delay is synced to')
+    parser.add_argument('--delay', type=float, default=defaults.delay_beats,
+                        help='delay time in beats, 0 disables the delay')
+    parser.add_argument('--delay-feedback', type=float,
+                        default=defaults.delay_feedback)
+    parser.add_argument('--fdn-reverb', type=float,
+                        default=defaults.fdn_reverb,
+                        help='algorithmic reverb wet level, 0 disables it')
+    parser.add_argument('--fdn-t60', type=float, default=defaults.fdn_t60,
+                        help='algorithmic reverb decay time in seconds')
+    parser.add_argument('--reverb', default=defaults.reverb_ir,
+                        help='impulse response WAV of the convolution reverb')
+    parser.add_argument('--reverb-wet', type=float,
+                        default=defaults.reverb_wet)
+    parser.add_argument('--compressor', action='store_true',
+                        help='compress the output bus')
+    parser.add_argument('--compressor-threshold', type=float,
+                        default=defaults.compressor_threshold,
+                        help='compressor threshold in dBFS')
+    parser.add_argument('--compressor-ratio', type=float,
+                        default=defaults.compressor_ratio)
+    parser.add_argument('--limiter', action='store_true',
+                        help='limit the output bus to the ceiling')
+    parser.add_argument('--limiter-ceiling', type=float,
+                        default=defaults.limiter_ceiling,
+                        help='limiter ceiling in dBTP')
+    parser.add_argument('--route', action='append', type=parse_route,
+                        metavar='SOURCE:DEST:DEPTH',
+                        help='modulation matrix route, e.g. lfo:pitch:0.02; '
+                        'replaces the classic LFO routing (see modmatrix.py)')
+
+
+def patch_from_args(args):
+    return Patch(wave_type=args.wave,
+                 unison=args.unison,
+                 unison_detune=args.unison_detune,
+                 unison_spread=args.unison_spread,
+                 pan=args.pan,
+                 pan_spread=args.pan_spread,
+                 bend_range=args.bend_range,
+                 glide=args.glide,
+                 glide_curve=args.glide_curve,
+                 glide_legato=args.glide_legato,
+                 partials=args.partials,
+                 fm_algorithm=args.fm_algorithm,
+                 sample_library=args.samples,
+                 wavetable=args.wavetable,
+                 wavetable_position=args.wavetable_position,
+                 lfo_wave_type=args.lfo_wave,
+                 lfo_freq=args.lfo_freq,
+                 lfo_global=args.lfo_global,
+                 attack_duration=args.attack,
+                 decay_duration=args.decay,
+                 sustain_level=args.sustain,
+                 release_duration=args.release,
+                 cutoff=args.cutoff,
+                 lpf_intensity=args.lpf_intensity,
+                 chorus=args.chorus,
+                 tempo=args.tempo,
+                 delay_beats=args.delay,
+                 delay_feedback=args.delay_feedback,
+                 fdn_reverb=args.fdn_reverb,
+                 fdn_t60=args.fdn_t60,
+                 reverb_ir=args.reverb,
+                 reverb_wet=args.reverb_wet,
+                 compressor=args.compressor,
+                 compressor_threshold=args.compressor_threshold,
+                 compressor_ratio=args.compressor_ratio,
+                 limiter=args.limiter,
+                 limiter_ceiling=args.limiter_ceiling,
+                 mod_routes=args.route)
+
+
+def render_midi(midi_path, wav_path, patch, config=None, max_voices=8,
+                threads=1, max_tail=10., seed=0, parts=None):
+    """Render ``midi_path`` into ``wav_path`` and return render statistics.
+
+    Blocks are cut at MIDI events so notes start on the right sample. After
+    the last event rendering goes on until the release tail has ended, or
+    for at most ``max_tail`` seconds. The same ``seed`` renders the same
+    noise. ``config`` defaults to blocks of 4096 samples at 22,050 Hz.
+    ``parts`` maps MIDI channels to their own patches (see parse_parts).
+    """
+    if config is None:
+        config = EngineConfig(block_size=4096)
+    sample_rate = config.sample_rate
+    block_size = config.block_size
+    patches, budgets = parse_parts(parts or {})
+    synth = Multitimbral(patch, patches, budgets, max_voices=max_voices,
+                         threads=threads, seed=seed, **config.synth_args())
+    n_written = 0
+
+    with wave.open(wav_path, 'wb') as wav:
+        wav.setnchannels(config.channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+
+        def render_until(end):
+            nonlocal n_written
+            while n_written < end:
+                n = min(block_size, end - n_written)
+                wav.writeframes(
+                    to_int16(synth.render(n), config.channels).tobytes())
+                n_written += n
+
+        for seconds, status, data1, data2 in read_midi_file(midi_path):
+            render_until(int(round(seconds * sample_rate)))
+            channel = status & 0x0F
+            if status & 0xF0 == 0x90:
+                synth.note_on(midi_to_frequency(data1), note=data1,
+                              velocity=data2, channel=channel)
+            elif status & 0xF0 == 0x80:
+                synth.note_off(note=data1, channel=channel)
+            elif status & 0xF0 == 0xB0:
+                synth.control_change(data1, data2, channel=channel)
+            elif status & 0xF0 == 0xE0:
+                synth.pitch_bend(data1 | data2 << 7, channel=channel)
+
+        tail_end = n_written + int(max_tail * sample_rate)
+        while not synth.ended and n_written < tail_end:
+            render_until(min(n_written + block_size, tail_end))
+
+    synth.close()
+    return {
+        'audio_seconds': n_written / sample_rate,
+        'skipped_voice_blocks': synth.skipped_voice_blocks,
+        'dynamics': synth.dynamics_metrics,
+    }
+
+
+def load_jobs(batch_path, out_dir):
+    with open(batch_path) as f:
+        jobs = json.load(f)
+    for idx, job in enumerate(jobs):
+        if 'output' not in job:
+            stem = os.path.splitext(os.path.basename(job['midi']))[0]
+            job['output'] = os.path.join(out_dir, f'{idx:04d}_{stem}.wav')
+        job.setdefault('patch', {})
+    return jobs
+
+
+def _render_job(job, config):
+    start = time.perf_counter()
+    stats = render_midi(job['midi'],
+                        job['output'],
+                        Patch(**job['patch']),
+                        config,
+                        seed=job.get('seed', 0),
+                        parts=job.get('parts'))
+    elapsed = time.perf_counter() - start
+    return dict(job,
+                **stats,
+                render_seconds=elapsed,
+                realtime_factor=stats['audio_seconds'] / elapsed,
+                pid=os.getpid())
+
+
+def render_batch(jobs, workers=None, config=None):
+    """Render ``jobs`` on a process pool and return the manifest dict."""
+    workers = workers or os.cpu_count()
+    if config is None:
+        config = EngineConfig(block_size=4096)
+    patches = [Patch(**job['patch']) for job in jobs]
+    for job in jobs:
+        patches += parse_parts(job.get('parts', {}))[0].values()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=config.prepare,
+                             initargs=(patches, )) as executor:
+        results = list(
+            executor.map(_render_job, jobs, [config] * len(jobs)))
+    wall_time = time.perf_counter() - start
+    audio_seconds = sum(r['audio_seconds'] for r in results)
+    return {
+        'workers': workers,
+        'sample_rate': config.sample_rate,
+        'block_size': config.block_size,
+        'oversample': config.oversample,
+        'wall_seconds': wall_time,
+        'audio_seconds': audio_seconds,
+        'realtime_factor': audio_seconds / wall_time,
+        'jobs': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('midi_file', nargs='?')
+    parser.add_argument('-o', '--output',
+                        help='WAV file to write, defaults to <midi_file>.wav')
+    parser.add_argument('--batch', help='JSON list of jobs to render')
+    parser.add_argument('--out-dir', default='.',
+                        help='where batch renders and manifest.json go')
+    parser.add_argument('--workers', type=int,
+                        help='batch worker processes, one per core by default')
+    add_config_arguments(parser)
+    parser.add_argument('--voices', type=int, default=8,
+                        help='polyphony, the oldest voice is stolen beyond it')
+    parser.add_argument('--parts',
+                        help='JSON file of patches by MIDI channel')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='threads rendering voice groups of each block')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the noise waves')
+    add_patch_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args, block_size=4096)
+
+    if args.batch:
+        os.makedirs(args.out_dir, exist_ok=True)
+        jobs = load_jobs(args.batch, args.out_dir)
+        manifest = render_batch(jobs,
+                                workers=args.workers,
+                                config=config)
+        manifest_path = os.path.join(args.out_dir, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        print(f'{len(jobs)} jobs on {manifest["workers"]} workers: '
+              f'{manifest["audio_seconds"]:.1f}s of audio in '
+              f'{manifest["wall_seconds"]:.2f}s '
+              f'({manifest["realtime_factor"]:.1f}x realtime), '
+              f'manifest in {manifest_path}')
+        return
+    if args.midi_file is None:
+        parser.error('either midi_file or --batch is required')
+
+    output = args.output or os.path.splitext(args.midi_file)[0] + '.wav'
+    parts = None
+    if args.parts is not None:
+        with open(args.parts) as f:
+            parts = json.load(f)
+    start = time.perf_counter()
+    stats = render_midi(args.midi_file,
+                        output,
+                        patch_from_args(args),
+                        config,
+                        max_voices=args.voices,
+                        threads=args.threads,
+                        seed=args.seed,
+                        parts=parts)
+    elapsed = time.perf_counter() - start
+    seconds = stats['audio_seconds']
+    print(f'{output}: {seconds:.1f}s of audio in {elapsed:.2f}s '
+          f'({seconds / elapsed:.1f}x realtime), '
+          f'{stats["skipped_voice_blocks"]} silent voice blocks skipped')
+    for name, metrics in stats['dynamics'].items():
+        print(f'{name}: {metrics["latency_ms"]:.1f}ms latency, '
+              f'{metrics["max_gain_reduction_db"]:.1f}dB max gain reduction')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Sample playback voices from a multisample library.
+
+A library is a JSON file that maps note names to WAV files, relative to the
+JSON file:
+
+    {"C2": "piano_c2.wav", "C3": "piano_c3.wav", "G3": "piano_g3.wav"}
+
+Each sample plays the keys nearest to its root note. The WAV data is
+memory-mapped, not loaded: only the first block of every sample is read
+up front, so a note can start at once. The rest is paged in from disk as
+the note plays, and the OS can drop those pages again. Opening a
+library therefore takes about the same time and memory whatever its size.
+
+Pitch is shifted by reading the sample at a fractional rate with linear
+interpolation, a block at a time.
+"""
+import functools
+import json
+import os
+
+import numpy as np
+
+import librosa
+from oscillators import Oscillator
+from wavfile import WavFile
+
+PRELOAD_FRAMES = 4096
+
+
+class Sample:
+    """One memory-mapped WAV file and its root note."""
+
+    def __init__(self, path, root_note, preload=PRELOAD_FRAMES):
+        self.wav = WavFile(path)
+        self.root_note = root_note
+        self.root_freq = float(librosa.midi_to_hz(root_note))
+        self.sample_rate = self.wav.sample_rate
+        self.length = len(self.wav)
+        self.head = self.wav.read_mono(0, min(preload, self.length))
+
+    def read(self, start, stop):
+        """Mono frames ``start`` to ``stop``, zero past the end."""
+        out = np.zeros(stop - start)
+        end = min(stop, self.length)
+        if start < end:
+            if end <= len(self.head):
+                out[:end - start] = self.head[start:end]
+            else:
+                out[:end - start] = self.wav.read_mono(start, end)
+        return out
+
+
+class SampleLibrary:
+
+    def __init__(self, path, preload=PRELOAD_FRAMES):
+        with open(path) as f:
+            mapping = json.load(f)
+        root = os.path.dirname(os.path.abspath(path))
+        self.samples = sorted(
+            (Sample(os.path.join(root, wav_path),
+                    int(librosa.note_to_midi(note)),
+                    preload=preload) for note, wav_path in mapping.items()),
+            key=lambda sample: sample.root_note)
+        assert self.samples, f'No samples in {path}'
+        self._roots = np.array([s.root_note for s in self.samples])
+
+    def sample_for(self, freq):
+        """The sample whose root note is nearest to ``freq``."""
+        note = librosa.hz_to_midi(freq)
+        return self.samples[int(np.argmin(np.abs(self._roots - note)))]
+
+
+@functools.lru_cache(maxsize=16)
+def load_sample_library(path):
+    """Shared SampleLibrary of ``path``, opened once per process."""
+    return SampleLibrary(path)
+
+
+class SamplerOscillator(Oscillator):
+    """Plays the library's sample for ``freq`` once, pitched to ``freq``."""
+
+    def __init__(self,
+                 freq=440,
+                 library=None,
+                 amp=1,
+                 sample_rate=44_100,
+                 wave_range=(-1, 1)):
+        super().__init__(freq, 0, amp, sample_rate, wave_range)
+        assert library is not None, 'SamplerOscillator needs a library'
+        self.sample = library.sample_for(freq)
+        # sample frames per output sample and Hz
+        self._rate = self.sample.sample_rate / sample_rate / \
+            self.sample.root_freq
+
+    def _initialize_osc(self):
+        self._pos = 0.
+
+    def __next__(self):
+        return self.render(1)[0]
+
+    @property
+    def ended(self):
+        return self._pos >= self.sample.length
+
+    def render(self, n, freq=None, amp=None, phase=None):
+        if freq is None:
+            steps = np.full(n, self._f * self._rate)
+        else:
+            steps = freq * self._rate
+            self.freq = freq[-1]
+        pos = np.empty(n)
+        pos[0] = 0
+        np.cumsum(steps[:-1], out=pos[1:])
+        pos += self._pos
+        self._pos = pos[-1] + steps[-1]
+
+        start = int(pos[0])
+        frames = self.sample.read(start, int(pos[-1]) + 2)
+        idx = pos.astype(int) - start
+        frac = pos - np.floor(pos)
+        val = frames[idx] + frac * (frames[idx + 1] - frames[idx])
+        return self._apply_amp(val, amp)
@@ -0,0 +1,214 @@
+"""Regression checks of the synth engine, run with ``python -m pytest``."""
+import numpy as np
+import pytest
+import scipy.signal
+
+from blocksize import BlockSizeController
+from dynamics import Compressor, db_to_gain
+from engine import Patch, Synth
+from multitimbral import Multitimbral, parse_parts
+from oscillators import SineOscillator, WaveAdder
+
+RATE = 22_050
+BLOCK = 256
+
+
+def zero_crossings(x):
+    return int(np.count_nonzero(np.diff(np.signbit(x))))
+
+
+def held_note(patch, freq=220., seconds=0.):
+    synth = Synth(patch, sample_rate=RATE)
+    synth.note_on(freq, note=57)
+    for _ in range(int(seconds * RATE / BLOCK)):
+        synth.render(BLOCK)
+    return synth
+
+
+@pytest.mark.parametrize('wave_type', ['sine', 'sawtooth', 'triangle'])
+def test_pitch_bend_bends_pitch(wave_type):
+    patch = Patch(wave_type=wave_type, attack_duration=0.001,
+                  sustain_level=1.)
+    synth = held_note(patch, seconds=3.5)
+    synth.pitch_bend(8192 + 4096)  # a semitone up
+    # 220-233 Hz crosses zero twice a cycle, about 5 times in the block
+    assert zero_crossings(synth.render(BLOCK)) <= 6
+    bent = np.concatenate([synth.render(BLOCK) for _ in range(40)])
+    freq = zero_crossings(bent) / 2 / (len(bent) / RATE)
+    assert freq == pytest.approx(220 * 2**(1 / 12), rel=0.02)
+
+
+@pytest.mark.parametrize('wave_type', ['sine', 'sawtooth', 'triangle'])
+def test_glide_stays_between_notes(wave_type):
+    patch = Patch(wave_type=wave_type, glide=0.2, attack_duration=0.001,
+                  sustain_level=1., release_duration=0.001)
+    synth = held_note(patch, seconds=0.2)
+    synth.note_off(57)
+    synth.render(BLOCK * 8)
+    synth.note_on(440., note=69)
+    x = np.concatenate([synth.render(BLOCK) for _ in range(40)])
+    chunks = np.array_split(x, 10)
+    freqs = [zero_crossings(c) / 2 / (len(c) / RATE) for c in chunks]
+    assert min(freqs) > 200 and max(freqs) < 470
+    # after the glide the note stays at its own pitch
+    assert freqs[-1] == pytest.approx(440, rel=0.03)
+
+
+@pytest.mark.parametrize('cutoff', [0, 500])
+def test_cutoff_route_renders(cutoff):
+    patch = Patch(wave_type='sawtooth', cutoff=cutoff, lfo_freq=5,
+                  lfo_global=True, mod_routes=[('lfo', 'cutoff', 2000.)])
+    synth = held_note(patch)
+    x = np.concatenate([synth.render(BLOCK) for _ in range(8)])
+    assert np.isfinite(x).all() and x.any()
+
+
+@pytest.mark.parametrize('source', ['env', 'velocity'])
+def test_per_voice_cutoff_sources_are_rejected(source):
+    with pytest.raises(AssertionError):
+        Synth(Patch(mod_routes=[(source, 'cutoff', 1000.)])).note_on(220.)
+
+
+def test_per_voice_lfo_cutoff_is_rejected():
+    patch = Patch(lfo_freq=5, mod_routes=[('lfo', 'cutoff', 1000.)])
+    with pytest.raises(AssertionError):
+        Synth(patch).note_on(220.)
+
+
+def test_busy_channel_steals_from_itself():
+    synth = Multitimbral(max_voices=4, sample_rate=RATE)
+    for note in range(60, 64):
+        synth.note_on(440., note=note, channel=0)
+    # the quiet channel takes the busy channel's oldest voice
+    synth.note_on(440., note=40, channel=1)
+    synth.render(BLOCK)
+    assert synth.voice_count == 4
+    assert [v.note for v in synth.parts[0].voices] == [61, 62, 63]
+    # more notes on the busy channel only cost it its own voices
+    for note in range(64, 67):
+        synth.note_on(440., note=note, channel=0)
+        synth.render(BLOCK)
+    assert synth.voice_count == 4
+    assert [v.note for v in synth.parts[0].voices] == [64, 65, 66]
+    assert [v.note for v in synth.parts[1].voices] == [40]
+
+
+def test_zero_voice_budget_is_rejected():
+    with pytest.raises(AssertionError):
+        parse_parts({'2': {'voices': 0}})
+
+
+def test_channels_without_a_part_follow_channel_0():
+    synth = Multitimbral(sample_rate=RATE)
+    synth.note_on(220., note=57, channel=2)
+    synth.set_param('cutoff', 1500)
+    synth.set_param('wave_type', 'square')
+    assert synth.parts[2].patch.cutoff == 1500
+    assert synth.parts[2].patch.wave_type == 'square'
+
+
+def test_only_silent_voice_renders_are_skipped():
+    synth = held_note(Patch(release_duration=0.01))
+    synth.note_off(57)
+    for _ in range(100):
+        synth.render(BLOCK)
+    # a finished note leaves an idle slot, not skipped renders
+    assert synth.skipped_voice_blocks == 0
+
+    synth = held_note(Patch(attack_duration=0.01, decay_duration=0.05,
+                            sustain_level=0.))
+    for _ in range(20):
+        x = synth.render(BLOCK)
+    assert synth.skipped_voice_blocks > 0 and not x.any()
+
+
+@pytest.mark.parametrize('stereo', [False, True])
+def test_wave_adder_block_matches_samples(stereo):
+    def adder():
+        return iter(WaveAdder(SineOscillator(220., sample_rate=RATE),
+                              SineOscillator(330., sample_rate=RATE),
+                              stereo=stereo))
+
+    stepped = adder()
+    samples = np.array([next(stepped) for _ in range(BLOCK)])
+    block = adder().render(BLOCK)
+    assert np.allclose(block, samples.T if stereo else samples)
+
+
+def controller(**kwargs):
+    # loads are render_seconds * 10 for blocks of 100 samples at 1 kHz
+    args = dict(min_size=100, max_size=400, min_depth=2, max_depth=3,
+                window=4, cooldown=3)
+    args.update(kwargs)
+    return BlockSizeController(1000, **args)
+
+
+def feed(control, load, blocks):
+    return [control.update(load / 10, 100) for _ in range(blocks)]
+
+
+def test_block_size_grows_under_load():
+    control = controller()
+    # nothing changes before the window is full
+    assert feed(control, 0.9, 4) == [False, False, False, True]
+    assert (control.block_size, control.depth) == (200, 3)
+
+
+def test_block_size_waits_for_cooldown():
+    control = controller(cooldown=6)
+    feed(control, 0.9, 4)
+    # no change during the cooldown, though the window is full again
+    assert not any(feed(control, 0.9, 6))
+    assert feed(control, 0.9, 1) == [True]
+    assert (control.block_size, control.depth) == (400, 3)
+
+
+def test_block_size_respects_limits():
+    control = controller()
+    feed(control, 0.9, 100)
+    assert (control.block_size, control.depth) == (400, 3)
+    feed(control, 0.05, 100)
+    assert (control.block_size, control.depth) == (100, 2)
+
+
+def test_block_size_shrinks_when_idle():
+    control = controller(min_size=50, min_depth=1)
+    control.block_size, control.depth = 200, 3
+    assert feed(control, 0.1, 4)[-1]
+    assert (control.block_size, control.depth) == (100, 2)
+
+
+def test_block_size_stays_between_thresholds():
+    control = controller()
+    control.block_size = 200
+    assert not any(feed(control, 0.4, 50))
+    assert (control.block_size, control.depth) == (200, 2)
+    # a single slow block in the window is enough to grow
+    feed(control, 0.4, 3)
+    assert feed(control, 0.7, 1) == [True]
+
+
+def true_peak_db(x):
+    return 20 * np.log10(np.abs(scipy.signal.resample_poly(x, 4, 1)).max())
+
+
+@pytest.mark.parametrize('wave_type', ['sine', 'sawtooth', 'square'])
+def test_limiter_holds_the_true_peak_ceiling(wave_type):
+    patch = Patch(wave_type=wave_type, sustain_level=1., limiter=True)
+    synth = held_note(patch)
+    x = np.concatenate([synth.render(BLOCK) for _ in range(80)])
+    # within the interpolator's half a dB near Nyquist, see dynamics.py
+    assert true_peak_db(x) <= -1 + 0.5
+    if wave_type == 'sine':
+        assert np.abs(x).max() == pytest.approx(db_to_gain(-1), abs=0.005)
+
+
+@pytest.mark.parametrize('level, expected', [(0, -13.5), (-24, -24)])
+def test_compressor_gain_curve(level, expected):
+    # threshold -18 dB and ratio 4: 18 dB over comes out 4.5 dB over
+    compressor = Compressor(RATE, threshold=-18., ratio=4.)
+    t = np.arange(RATE) / RATE
+    sine = db_to_gain(level) * np.sin(2 * np.pi * 440 * t)
+    out = np.concatenate([compressor(b) for b in np.split(sine, 50)])
+    peak = 20 * np.log10(np.abs(out[-RATE // 5:]).max())
+    assert peak == pytest.approx(expected, abs=0.1)
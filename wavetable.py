@@ -0,0 +1,80 @@
+"""Wavetables imported from WAV files, with mip-maps cached on disk.
+
+A WAV file whose length is a multiple of ``frame_size`` is read as that
+many single-cycle frames. Any other file is one cycle and is resampled to
+``frame_size``. For every frame the mip-maps keep fewer and fewer
+harmonics, one octave per level, so no voice plays harmonics above
+Nyquist (see WavetableOscillator).
+
+Building the mip-maps takes an FFT per frame and level. The result is
+saved as a .npy file named after the SHA-1 of the WAV content and the frame
+size. Later loads memory-map that file, so restarts and every voice share
+one read-only copy.
+"""
+import functools
+import hashlib
+import os
+
+import numpy as np
+
+from wavfile import WavFile
+
+CACHE_DIR = os.environ.get(
+    'JONTHESIZER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'jonthesizer'))
+FRAME_SIZE = 2048
+_CACHE_VERSION = 1  # bump when the mip-map layout changes
+
+
+def content_hash(path, frame_size):
+    sha1 = hashlib.sha1(f'{_CACHE_VERSION}:{frame_size}:'.encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def read_frames(path, frame_size=FRAME_SIZE):
+    """(frames, frame_size) single cycles of the WAV file at ``path``."""
+    wav = WavFile(path)
+    samples = wav.read_mono(0, len(wav))
+    if len(samples) >= frame_size and len(samples) % frame_size == 0:
+        return samples.reshape(-1, frame_size)
+    # one cycle of any length, resampled by zero-padding its spectrum
+    spectrum = np.fft.rfft(samples)[:frame_size // 2 + 1]
+    scale = frame_size / len(samples)
+    return np.fft.irfft(spectrum, frame_size)[None] * scale
+
+
+def build_mipmaps(frames):
+    """(levels, frames, size) tables, level l band-limited to the lowest
+    size/2 >> l harmonics."""
+    size = frames.shape[1]
+    spectra = np.fft.rfft(frames, axis=1)
+    levels = int(np.log2(size // 2)) + 1
+    mipmaps = np.empty((levels, len(frames), size), np.float32)
+    for level in range(levels):
+        harmonics = (size // 2) >> level
+        band = spectra.copy()
+        band[:, harmonics + 1:] = 0
+        mipmaps[level] = np.fft.irfft(band, size, axis=1)
+    return mipmaps
+
+
+@functools.lru_cache(maxsize=16)
+def load_wavetable(path, frame_size=FRAME_SIZE, cache_dir=CACHE_DIR):
+    """Mip-maps of the WAV file at ``path``, from the disk cache if it has
+    them, as a read-only memory-mapped array."""
+    cache_path = os.path.join(cache_dir,
+                              content_hash(path, frame_size) + '.npy')
+    if not os.path.exists(cache_path):
+        mipmaps = build_mipmaps(read_frames(path, frame_size))
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename, so a concurrent load never sees half a file
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, mipmaps)
+        os.replace(tmp_path, cache_path)
+        print(f'wavetable {path}: {mipmaps.shape[1]} frames cached in '
+              f'{cache_path}')
+    return np.load(cache_path, mmap_mode='r')
@@ -0,0 +1,70 @@
+"""Memory-mapped WAV files.
+
+Only the RIFF header is read; the sample data is mapped with numpy.memmap,
+so opening a file costs the same whatever its size and pages are only read
+from disk when they are used.
+"""
+import struct
+
+import numpy as np
+
+_PCM = 1
+_FLOAT = 3
+_EXTENSIBLE = 0xFFFE
+
+_DTYPES = {
+    (_PCM, 8): ('u1', 1 / 128, -1.),
+    (_PCM, 16): ('<i2', 1 / 32768, 0.),
+    (_PCM, 32): ('<i4', 1 / 2**31, 0.),
+    (_FLOAT, 32): ('<f4', 1., 0.),
+    (_FLOAT, 64): ('<f8', 1., 0.),
+}
+
+
+class WavFile:
+    """``data`` is a read-only (frames, channels) memmap of the raw samples;
+    ``to_float`` scales any slice of it to [-1, 1]."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+            assert riff == b'RIFF' and wave_id == b'WAVE', \
+                f'Not a WAV file: {path}'
+            fmt = None
+            while True:
+                header = f.read(8)
+                assert len(header) == 8, f'No data chunk in {path}'
+                chunk_id, size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt = f.read(size)
+                    f.seek(size % 2, 1)
+                elif chunk_id == b'data':
+                    offset = f.tell()
+                    break
+                else:
+                    f.seek(size + size % 2, 1)
+        assert fmt is not None, f'No fmt chunk in {path}'
+
+        tag, channels, sample_rate, _, _, bits = struct.unpack(
+            '<HHIIHH', fmt[:16])
+        if tag == _EXTENSIBLE:
+            tag = struct.unpack('<H', fmt[24:26])[0]
+        assert (tag, bits) in _DTYPES, \
+            f'Unsupported WAV format {tag} with {bits} bits: {path}'
+        dtype, self._scale, self._shift = _DTYPES[tag, bits]
+        frames = size // (channels * bits // 8)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.data = np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                              shape=(frames, channels))
+
+    def __len__(self):
+        return len(self.data)
+
+    def to_float(self, frames):
+        return frames.astype(float) * self._scale + self._shift
+
+    def read_mono(self, start, stop):
+        """Frames ``start`` to ``stop`` mixed down to one channel."""
+        return self.to_float(self.data[start:stop]).mean(axis=1)
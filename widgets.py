@@ -3,6 +3,8 @@ import PyQt6.QtWidgets as qtw
 import pyqtgraph as pg
 from matplotlib import cm
 
+from envelope import adsr_shape
+
 
 class LabelDial(qtw.QVBoxLayout):
 
@@ -76,8 +78,12 @@ class SpectrogramWidget(pg.PlotWidget):
         # self.show()
 
     def update(self, chunk):
+        # blocks can change size: shorter ones are zero-padded
+        chunk = chunk[-self.buf_size:]
+        win = self.win if len(chunk) == self.buf_size else np.hanning(
+            len(chunk))
         # normalized, windowed frequencies in data chunk
-        spec = np.fft.rfft(chunk * self.win) / self.buf_size
+        spec = np.fft.rfft(chunk * win, self.buf_size) / len(chunk)
         # get magnitude
         psd = abs(spec)
         # convert to dB scale
@@ -96,6 +102,7 @@ class ADSRWidget(pg.PlotWidget):
         super(ADSRWidget, self).__init__()
         self.sample_rate = sample_rate
         self.buf_size = buf_size
+        self.adsr_params = None
 
         self.curve = self.plot()
         xticks = {}
@@ -107,4 +114,23 @@ class ADSRWidget(pg.PlotWidget):
             xticks[bin] = f'{ms:.1f}'
         ax = self.getAxis('bottom')
         ax.setTicks([xticks.items()])
-        self.setLabel('bottom', 'Time', units='ms')
\ No newline at end of file
+        self.setLabel('bottom', 'Time', units='ms')
+
+    def set_envelope(self, attack_duration, decay_duration, sustain_level,
+                     release_duration):
+        self.adsr_params = (attack_duration, decay_duration, sustain_level,
+                            release_duration)
+        self._redraw()
+
+    def resizeEvent(self, ev):
+        super(ADSRWidget, self).resizeEvent(ev)
+        self._redraw()
+
+    def _redraw(self):
+        if self.adsr_params is None:
+            return
+        # one point per horizontal pixel is all the plot can show
+        x, y = adsr_shape(*self.adsr_params,
+                          sample_rate=self.sample_rate,
+                          n_points=self.width())
+        self.curve.setData(x, y)